@@ -1,6 +1,16 @@
+import os
 import cocotb
 from cocotb.triggers import Timer
 
+# the outputs of the design's interfaces as name:width,name:width..., set by Project.test_tristate_z from projects.yaml
+def get_tristate_ports():
+    ports = []
+    for port in os.environ['TRISTATE_PORTS'].split(','):
+        if port:
+            name, width = port.split(':')
+            ports.append((name, int(width)))
+    return ports
+
 @cocotb.test()
 async def test_output_z(dut):
 
@@ -11,38 +21,11 @@ async def test_output_z(dut):
     # not active
     dut.active.value = 0
 
+    ports = get_tristate_ports()
     for i in range(10):
         await Timer(1, units="ns")
 
-        # all outputs that exist must be z
-        if getattr(dut, "io_oeb", None):
-            assert str(dut.io_oeb.value)        == 'z' * 38
-        if getattr(dut, "io_out", None):
-            assert str(dut.io_out.value)        == 'z' * 38
-        # la
-        if getattr(dut, "la_data_out", None):
-            assert str(dut.la_data_out.value)   == 'z' * 32
-        # wb
-        if getattr(dut, "wbs_ack_o", None):
-            assert str(dut.wbs_ack_o.value)     == 'z'
-        if getattr(dut, "wbs_dat_o", None):
-            assert str(dut.wbs_dat_o.value)     == 'z' * 32
-        # rambus
-        if getattr(dut, "rambus_wb_clk_o", None):
-            assert str(dut.rambus_wb_clk_o.value)     == 'z' * 1
-        if getattr(dut, "rambus_wb_rst_o", None):
-            assert str(dut.rambus_wb_rst_o.value)     == 'z' * 1
-        if getattr(dut, "rambus_wb_stb_o", None):
-            assert str(dut.rambus_wb_stb_o.value)     == 'z' * 1
-        if getattr(dut, "rambus_wb_cyc_o", None):
-            assert str(dut.rambus_wb_cyc_o.value)     == 'z' * 1
-        if getattr(dut, "rambus_wb_we_o", None):
-            assert str(dut.rambus_wb_we_o.value)      == 'z' * 1
-        if getattr(dut, "rambus_wb_sel_o", None):
-            assert str(dut.rambus_wb_sel_o.value)     == 'z' * 4
-        if getattr(dut, "rambus_wb_dat_o", None):
-            assert str(dut.rambus_wb_dat_o.value)     == 'z' * 32
-        if getattr(dut, "rambus_wb_adr_o", None):
-            assert str(dut.rambus_wb_adr_o.value)     == 'z' * 10
-
-
+        # all outputs must be z
+        for name, width in ports:
+            value = str(getattr(dut, name).value)
+            assert value == 'z' * width, "%s is %s, should be all z when not active" % (name, value)
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+# bump this to invalidate all existing entries if the way keys are built changes
+CACHE_VERSION = 1
+
+# commands used to get the version of each tool, anything not listed is run with --version
+TOOL_VERSION_COMMANDS = {
+    'iverilog': ['iverilog', '-V'],
+    'yosys':    ['yosys', '-V'],
+    'netgen':   ['netgen', '-batch', 'quit'],
+}
+
+file_hashes = {}
+tool_versions = {}
+hash_lock = threading.Lock()
+
+# sha256 of a file's contents, remembered by path, size and mtime so each file is only read once per run
+def hash_file(path):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with hash_lock:
+        if key in file_hashes:
+            return file_hashes[key]
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            sha.update(block)
+
+    with hash_lock:
+        file_hashes[key] = sha.hexdigest()
+    return file_hashes[key]
+
+# first line of the tool's version output, or the path if the tool doesn't say
+def get_tool_version(tool):
+    with hash_lock:
+        if tool in tool_versions:
+            return tool_versions[tool]
+
+    cmd = TOOL_VERSION_COMMANDS.get(os.path.basename(tool), [tool, '--version'])
+    cmd = [tool] + cmd[1:]
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=30, stdin=subprocess.DEVNULL)
+        lines = (result.stdout + result.stderr).decode(errors='replace').strip().splitlines()
+        version = lines[0] if len(lines) else str(shutil.which(tool))
+    except (OSError, subprocess.TimeoutExpired):
+        version = 'not found'
+
+    with hash_lock:
+        tool_versions[tool] = version
+    return version
+
+class ResultCache(object):
+
+    def __init__(self, directory, enabled=True):
+        self.directory = directory
+        self.enabled = enabled
+
+    def key(self, *parts):
+        return hashlib.sha256(json.dumps([CACHE_VERSION, parts], sort_keys=True).encode()).hexdigest()
+
+    def path(self, namespace, key):
+        return os.path.join(self.directory, namespace, key + '.json')
+
+    # returns the stored data, or None if there is no entry
+    def get(self, namespace, key):
+        if not self.enabled:
+            return None
+        path = self.path(namespace, key)
+        try:
+            with open(path) as fh:
+                data = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return None
+        # entries are evicted by time since last use
+        os.utime(path)
+        return data
+
+    def put(self, namespace, key, data):
+        if not self.enabled:
+            return
+        path = self.path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename so that parallel readers never see a partial file
+        tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'w') as fh:
+            json.dump(data, fh)
+        os.replace(tmp_path, path)
+
+    # remove entries that haven't been used for the given number of days
+    def evict(self, max_age_days):
+        oldest = time.time() - max_age_days * 24 * 60 * 60
+        removed = 0
+        for root, dirs, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                if os.path.getmtime(path) < oldest:
+                    os.remove(path)
+                    removed += 1
+        logging.info("evicted %d cache entries older than %s days from %s" % (removed, max_age_days, self.directory))
+        return removed
@@ -1,7 +1,15 @@
 import itertools
-from typing import Dict, Tuple
+import math
+import random
+from typing import Dict, List, Tuple
 import logging
 
+# approximate positions of the user_project_wrapper pins for each interface, as fractions of the width and height.
+# the io pads go up the right side, right to left along the top and down the left side. the logic analyser pins run
+# along the bottom edge after the wishbone and clock pins in the bottom left corner
+LA_START = 0.2
+LA_END = 0.98
+
 def allocate_macros(
     design_size_x: int,
     design_size_y: int,
@@ -11,11 +19,16 @@ def allocate_macros(
     projects,
     allocation_policy: str,
     openram,
+    fixed_projects=(),
+    spacing: float = 40,
 ) -> Dict[int, Tuple[int, int]]:
 
     if allocation_policy == "legacy":
         return legacy_allocation(design_size_x, design_size_y, h_edge, v_edge, macro_snap, projects, openram)
 
+    if allocation_policy == "packed":
+        return packed_allocation(design_size_x, design_size_y, h_edge, v_edge, macro_snap, projects, openram, fixed_projects, spacing)
+
     logging.critical(f"unknown allocation policy {allocation_policy}")
     exit(1)
 
@@ -69,3 +82,207 @@ def legacy_allocation(
                 break
 
     return allocation
+
+def la_pin(bit: int, design_size_x: int) -> Tuple[float, float]:
+    return (design_size_x * (LA_START + (LA_END - LA_START) * (bit + 0.5) / 128), 0)
+
+# (x, y, weight) of the pins a project connects to, grouped by interface with the weight being the number of wires
+def interface_pins(project, design_size_x: int, design_size_y: int) -> List[Tuple[float, float, int]]:
+    pins = []
+    for interface in project.interfaces:
+        if interface == 'gpio':
+            io = [(design_size_x, design_size_y * (i + 0.5) / 14) for i in range(14)]
+            io += [(design_size_x * (1 - (i + 0.5) / 10), design_size_y) for i in range(10)]
+            io += [(0, design_size_y * (1 - (i + 0.5) / 14)) for i in range(14)]
+            # in, out and oeb of each pad
+            pins += [(x, y, 3) for x, y in io]
+        elif interface in ('la1', 'la2', 'la3'):
+            first_bit = 32 * int(interface[2])
+            x, y = la_pin(first_bit + 16, design_size_x)
+            pins.append((x, y, 96))
+        elif interface == 'active':
+            x, y = la_pin(project.id, design_size_x)
+            pins.append((x, y, 1))
+        elif interface in ('wishbone', 'clock', 'clk2', 'irq'):
+            pins.append((design_size_x * LA_START / 2, 0, 32 if interface == 'wishbone' else 1))
+
+    # sum the wires to each pin, so the cost of a position is one distance per pin
+    merged = {}
+    for x, y, weight in pins:
+        merged[(x, y)] = merged.get((x, y), 0) + weight
+    return [(x, y, weight) for (x, y), weight in merged.items()]
+
+def overlaps(rect, rects, spacing: float):
+    x1, y1, x2, y2 = rect
+    for ox1, oy1, ox2, oy2 in rects:
+        if x1 < ox2 + spacing and ox1 < x2 + spacing and y1 < oy2 + spacing and oy1 < y2 + spacing:
+            return (ox1, oy1, ox2, oy2)
+    return None
+
+# places the macros in the given order into rows from the bottom left, stepping over the fixed macros, then spreads the
+# rows and the macros in each row over the spare space to leave room for routing.
+# returns the positions and how far the macros go past the right and the top of the area
+def pack_rows(order, sizes, obstacles, design_size_x, design_size_y, h_edge, v_edge, spacing):
+    right = design_size_x - h_edge
+    top = design_size_y - v_edge
+    positions = [None] * len(sizes)
+    rows = []
+    row = []
+    row_height = 0
+    x = h_edge
+    y = v_edge
+    overflow_x = 0
+    for index in order:
+        width, height = sizes[index]
+        while True:
+            if x + width > right and (len(row) or x > h_edge):
+                # start a new row above the tallest macro in this one, or above whatever is blocking an empty row
+                if len(row):
+                    rows.append((y, row))
+                    y += row_height + spacing
+                else:
+                    blocking = [oy2 for ox1, oy1, ox2, oy2 in obstacles if oy1 < y + height + spacing and y < oy2 + spacing]
+                    y = (min(blocking) if len(blocking) else y) + spacing
+                row = []
+                row_height = 0
+                x = h_edge
+                continue
+            blocker = overlaps((x, y, x + width, y + height), obstacles, spacing)
+            if blocker is None:
+                break
+            x = blocker[2] + spacing
+
+        # a macro wider than the area is put at the start of an empty row, and sticks out of the right side
+        overflow_x = max(overflow_x, x + width - right)
+        positions[index] = (x, y)
+        row.append(index)
+        row_height = max(row_height, height)
+        x += width + spacing
+
+    if len(row):
+        rows.append((y, row))
+    overflow = (overflow_x, max(0, y + row_height - top))
+
+    # spread the rows up to the top of the area, as long as that doesn't hit a fixed macro
+    placed_top = max(positions[index][1] + sizes[index][1] for index in order)
+    if len(rows) > 1 and placed_top < top:
+        step = (top - placed_top) / (len(rows) - 1)
+        spread = list(positions)
+        for row_number, (row_y, row) in enumerate(rows):
+            for index in row:
+                spread[index] = (positions[index][0], positions[index][1] + step * row_number)
+        if all(overlaps((x, y, x + sizes[i][0], y + sizes[i][1]), obstacles, spacing) is None for i, (x, y) in enumerate(spread)):
+            positions = spread
+
+    # then spread each row across the width
+    for row_y, row in rows:
+        row_right = max(positions[index][0] + sizes[index][0] for index in row)
+        if len(row) < 2 or row_right >= right:
+            continue
+        step = (right - row_right) / (len(row) - 1)
+        spread = [(positions[index][0] + step * number, positions[index][1]) for number, index in enumerate(row)]
+        if all(overlaps((x, y, x + sizes[i][0], y + sizes[i][1]), obstacles, spacing) is None for i, (x, y) in zip(row, spread)):
+            for index, position in zip(row, spread):
+                positions[index] = position
+
+    return positions, overflow
+
+def wirelength(positions, sizes, pins) -> float:
+    total = 0
+    for (x, y), (width, height), macro_pins in zip(positions, sizes, pins):
+        centre_x = x + width / 2
+        centre_y = y + height / 2
+        for pin_x, pin_y, weight in macro_pins:
+            total += weight * (abs(centre_x - pin_x) + abs(centre_y - pin_y))
+    return total
+
+def packed_allocation(
+    design_size_x: int,
+    design_size_y: int,
+    h_edge: int,
+    v_edge: int,
+    macro_snap: float,
+    projects,
+    openram,
+    fixed_projects,
+    spacing: float,
+    iterations_per_macro: int = 300,
+) -> Dict[int, Tuple[int, int]]:
+
+    allocation = {}
+
+    # the shared projects stay where projects.yaml puts them
+    obstacles = []
+    for project in fixed_projects:
+        x, y, orient = project.get_macro_pos()
+        width, height = project.get_macro_size()
+        obstacles.append((x, y, x + width, y + height))
+
+    movable = list(projects)
+    if openram and len(obstacles):
+        # the shim has to be right next to the ram, which is the biggest of the shared macros
+        ram = max(obstacles, key=lambda box: (box[2] - box[0]) * (box[3] - box[1]))
+        for project in projects:
+            if project.title == 'wb_openram_shim':
+                x = round(int((ram[2] + spacing) / macro_snap) * macro_snap, 2)
+                y = round(int(ram[1] / macro_snap) * macro_snap, 2)
+                width, height = project.get_macro_size()
+                if x < h_edge or y < v_edge or x + width > design_size_x - h_edge or y + height > design_size_y - v_edge:
+                    logging.error("%s doesn't fit in the user area next to the ram at %s, %s" % (project, x, y))
+                    exit(1)
+                blocker = overlaps((x, y, x + width, y + height), obstacles, 0)
+                if blocker is not None:
+                    logging.error("%s next to the ram at %s, %s overlaps the macro at %s, %s" % (project, x, y, blocker[0], blocker[1]))
+                    exit(1)
+                allocation[project.id] = (x, y)
+                obstacles.append((x, y, x + width, y + height))
+                movable.remove(project)
+                logging.info("putting %s next to the ram at %s, %s" % (project, x, y))
+                break
+
+    # sizes are rounded up to the snap grid plus one more, so that snapping the positions can't make macros overlap
+    sizes = [tuple(math.ceil(size / macro_snap) * macro_snap + macro_snap for size in project.get_macro_size()) for project in movable]
+    pins = [interface_pins(project, design_size_x, design_size_y) for project in movable]
+
+    def cost(order):
+        positions, overflow = pack_rows(order, sizes, obstacles, design_size_x, design_size_y, h_edge, v_edge, spacing)
+        # anything that doesn't fit is far worse than any amount of wire
+        return wirelength(positions, sizes, pins) + sum(overflow) * design_size_x * 1000, positions, overflow
+
+    # start with the tallest first, which packs rows well, then anneal the order to shorten the wires
+    rng = random.Random(0)
+    order = sorted(range(len(movable)), key=lambda index: sizes[index][1], reverse=True)
+    current_cost, positions, overflow = cost(order)
+    best = (current_cost, list(order), positions, overflow)
+    iterations = iterations_per_macro * len(movable)
+    temperature = current_cost * 0.05
+    cooling = (1e-4) ** (1 / max(iterations, 1))
+    for iteration in range(iterations if len(movable) > 1 else 0):
+        candidate = list(order)
+        a, b = rng.sample(range(len(candidate)), 2)
+        if rng.random() < 0.5:
+            candidate[a], candidate[b] = candidate[b], candidate[a]
+        else:
+            candidate.insert(b, candidate.pop(a))
+        candidate_cost, candidate_positions, candidate_overflow = cost(candidate)
+        if candidate_cost < current_cost or rng.random() < math.exp((current_cost - candidate_cost) / max(temperature, 1e-9)):
+            order, current_cost = candidate, candidate_cost
+            if candidate_cost < best[0]:
+                best = (candidate_cost, list(candidate), candidate_positions, candidate_overflow)
+        temperature *= cooling
+
+    best_cost, order, positions, overflow = best
+    if overflow[0] > 0:
+        logging.error("macros don't fit in the user area, %d um too wide" % overflow[0])
+    if overflow[1] > 0:
+        logging.error("macros don't fit in the user area, %d um too tall" % overflow[1])
+    if sum(overflow) > 0:
+        exit(1)
+
+    for project, (x, y) in zip(movable, positions):
+        # snap up to the grid, the sizes were padded by a snap so this keeps the spacing and the edges
+        allocation[project.id] = (round(math.ceil(x / macro_snap) * macro_snap, 2), round(math.ceil(y / macro_snap) * macro_snap, 2))
+
+    used = sum(width * height for width, height in sizes)
+    logging.info("placed %d macros, %.1f%% of the user area, weighted wirelength %.0f um" % (len(movable), 100 * used / (design_size_x * design_size_y), best_cost))
+    return allocation
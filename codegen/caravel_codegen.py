@@ -1,68 +1,54 @@
 from typing import List, Dict, Optional
 from tabulate import tabulate
-import shutil
 import os
 import logging
+from codegen.output import write_if_changed
+from codegen.model import WrapperModel, Instance
 
 def generate_openlane_files(
-    projects, 
-    shared_projects,
-    interface_definitions: Dict[str, Dict[str, int]],
+    model: WrapperModel,
     target_user_project_wrapper_path: Optional[str],
     target_user_project_includes_path: Optional[str],
     target_caravel_includes_path: Optional[str],
-#    target_caravel_obstructions_path: Optional[str],
-#    target_macro_power_path: Optional[str],
-    openram,
-    gl,
-    config # this is getting silly now. These generators should be objects and get the config by default.
-) -> None:
+) -> List[str]:
 
-    ### user project wrapper ###
-    user_project_wrapper_filename = "user_project_wrapper.v"
-
-    logging.info(f"generating {user_project_wrapper_filename} locally")
-    generate_openlane_user_project_wrapper(projects, interface_definitions, user_project_wrapper_filename, openram, config)
+    # files are generated in place, or here if there is no target. returns the files that changed
+    changed: List[str] = []
 
-    if target_user_project_wrapper_path:
-        logging.info(f"{user_project_wrapper_filename} to {target_user_project_wrapper_path}")
-        shutil.move(user_project_wrapper_filename, target_user_project_wrapper_path)
-    else:
-        logging.info(f"leaving {user_project_wrapper_filename} here")
+    ### user project wrapper ###
+    user_project_wrapper_path = target_user_project_wrapper_path or "user_project_wrapper.v"
+    logging.info(f"generating {user_project_wrapper_path}")
+    if write_if_changed(user_project_wrapper_path, generate_openlane_user_project_wrapper(model)):
+        changed.append(user_project_wrapper_path)
     
     ### user project includes ###
     ### used for blackboxing the projects for the openlane config.tcl
-    user_project_includes_filename = "user_project_includes.v"
-
-    logging.info(f"generating {user_project_includes_filename} locally")
-    generate_openlane_user_project_include(projects, shared_projects, user_project_includes_filename)
-
-    if target_user_project_includes_path:
-        logging.info(f"{user_project_includes_filename} to {target_user_project_includes_path}")
-        shutil.move(user_project_includes_filename, target_user_project_includes_path)
-    else:
-        logging.info(f"leaving {user_project_includes_filename} here")
+    user_project_includes_path = target_user_project_includes_path or "user_project_includes.v"
+    logging.info(f"generating {user_project_includes_path}")
+    if write_if_changed(user_project_includes_path, generate_openlane_user_project_include(model)):
+        changed.append(user_project_includes_path)
     
     ### caravel includes ###
     ### for simulation - this needs to be altered for gate level sims
-    caravel_includes_filename = "includes.rtl.caravel_user_project"
+    caravel_includes_path = target_caravel_includes_path or "includes.rtl.caravel_user_project"
+    logging.info(f"generating {caravel_includes_path}")
+    if write_if_changed(caravel_includes_path, generate_caravel_includes(model)):
+        changed.append(caravel_includes_path)
 
-    logging.info(f"generating {caravel_includes_filename} locally")
-    generate_caravel_includes(projects, shared_projects, caravel_includes_filename, openram)
+    return changed
 
-    if target_caravel_includes_path:
-        logging.info(f"{caravel_includes_filename} to {target_caravel_includes_path}")
-        shutil.move(caravel_includes_filename, target_caravel_includes_path)
-    else:
-        logging.info(f"leaving {caravel_includes_filename} here")
+def read_template(filename: str) -> str:
+    codegen_dir = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(codegen_dir, filename), "r") as f:
+        return f.read()
 
-def generate_openlane_user_project_include(projects, shared_projects, outfile):
+def generate_openlane_user_project_include(model: WrapperModel) -> str:
     include_snippets: List[str] = []
 
     headers = ["project id", "title", "author", "repo", "commit"]
     table = [headers]
-    for project in projects:
-        table.append([project.id, project.title, project.author, project.repo, project.commit])
+    for instance in model.instances:
+        table.append([instance.id, instance.title, instance.author, instance.repo, instance.commit])
 
     for row in tabulate(
         table, 
@@ -72,78 +58,116 @@ def generate_openlane_user_project_include(projects, shared_projects, outfile):
     ).split("\n"):
         include_snippets.append(f"// {row}")
 
-    for project in projects:
-        top_module = project.get_top_module()
-        top_path = os.path.join(os.path.basename(project.directory), top_module)
-        include_snippets.append(f"`include \"{top_path}\" // {project.id}")
+    for instance in model.instances:
+        top_path = os.path.join(instance.directory, instance.top_source)
+        include_snippets.append(f"`include \"{top_path}\" // {instance.id}")
 
     include_snippets.append(f"// shared projects")
-    for project in shared_projects:
-        for path in project.get_module_source_paths(absolute=False):
-            path = os.path.join(os.path.basename(project.directory), path)
+    for instance in model.shared_instances:
+        for path in instance.sources:
+            path = os.path.join(instance.directory, path)
             include_snippets.append('`include "%s"' % path)
 
-    with open(outfile, "w") as f:
-        f.write("\n".join(include_snippets))
-
-def generate_caravel_includes(projects, shared_projects, outfile, openram):
-    codegen_dir = os.path.dirname(os.path.realpath(__file__))
-    with open(os.path.join(codegen_dir, "includes.rtl.caravel_user_project"), "r") as f:
-        filedata = f.read()
-
-    project_includes = ""
-    shared_project_includes = ""
-    for project in projects:
-        project_includes += ("// %s\n" % project)
-        for path in project.get_module_source_paths(absolute=False):
-            path = os.path.join(os.path.basename(project.directory), path)
-            project_includes += ('-v $(USER_PROJECT_VERILOG)/rtl/%s\n' % path)
-
-    for project in shared_projects:
-        project_includes += ("// %s\n" % project)
-        for path in project.get_module_source_paths(absolute=False):
-            path = os.path.join(os.path.basename(project.directory), path)
-            shared_project_includes += ('-v $(USER_PROJECT_VERILOG)/rtl/%s\n' % path)
-
-    project_includes += shared_project_includes
-    filedata = filedata.replace('RTL_INCLUDES', project_includes)
-
-    with open(outfile, "w") as f:
-        f.write(filedata)
-
-
-def generate_openlane_user_project_wrapper(projects, interface_definitions, outfile, openram, config):
+    return "\n".join(include_snippets)
+
+def generate_caravel_includes(model: WrapperModel) -> str:
+    project_includes: List[str] = []
+    shared_project_includes: List[str] = []
+    for instance in model.instances:
+        project_includes.append("// %s\n" % instance.description)
+        for path in instance.sources:
+            project_includes.append('-v $(USER_PROJECT_VERILOG)/rtl/%s\n' % os.path.join(instance.directory, path))
+
+    for instance in model.shared_instances:
+        project_includes.append("// %s\n" % instance.description)
+        for path in instance.sources:
+            shared_project_includes.append('-v $(USER_PROJECT_VERILOG)/rtl/%s\n' % os.path.join(instance.directory, path))
+
+    return read_template("includes.rtl.caravel_user_project").replace('RTL_INCLUDES', ''.join(project_includes + shared_project_includes))
+
+# gate level simulation of one project at a time: its netlist, the RTL wrapper and the other projects as blackboxes.
+# written to includes.gl.<instance name> in the includes directory, with a blackbox of each module in gl/blackbox. returns the files that changed
+def generate_gl_files(model: WrapperModel, includes_dir: str, gl_dir: str) -> List[str]:
+    changed: List[str] = []
+    blackbox_dir = os.path.join(gl_dir, "blackbox")
+    os.makedirs(blackbox_dir, exist_ok=True)
+    stubs: Dict[str, Instance] = {}
+    for instance in model.instances:
+        stubs.setdefault(instance.module, instance)
+    for module, instance in stubs.items():
+        stub_path = os.path.join(blackbox_dir, f"{module}.v")
+        if write_if_changed(stub_path, generate_blackbox_stub(instance)):
+            changed.append(stub_path)
+
+    for instance in model.instances:
+        includes_path = os.path.join(includes_dir, f"includes.gl.{instance.name}")
+        if write_if_changed(includes_path, generate_gl_includes(model, instance)):
+            changed.append(includes_path)
+    return changed
+
+def generate_gl_includes(model: WrapperModel, instance_under_test: Instance) -> str:
+    includes: List[str] = [
+        f"# Caravel user project gate level includes for {instance_under_test.description}",
+        "# the other projects are blackboxes, their outputs float like an inactive project's",
+        "-v $(USER_PROJECT_VERILOG)/rtl/user_project_wrapper.v",
+        f"-v $(USER_PROJECT_VERILOG)/gl/{instance_under_test.gl}",
+    ]
+    # --fill repeats a module, those instances are all the real netlist
+    modules = sorted(set(instance.module for instance in model.instances) - {instance_under_test.module})
+    for module in modules:
+        includes.append(f"-v $(USER_PROJECT_VERILOG)/gl/blackbox/{module}.v")
+
+    # the shared projects are wired up by hand in the template, so they are simulated from their RTL
+    for instance in model.shared_instances:
+        includes.append(f"// {instance.description}")
+        for path in instance.sources:
+            includes.append('-v $(USER_PROJECT_VERILOG)/rtl/%s' % os.path.join(instance.directory, path))
+    return "\n".join(includes) + "\n"
+
+# a module with the macro's ports and nothing in it
+def generate_blackbox_stub(instance: Instance) -> str:
+    # the power pins go last, as they are only there with USE_POWER_PINS. each port after the first starts with its comma,
+    # so the port list is right with or without them
+    power = [connection for connection in instance.connections if connection.interface == "power"]
+    others = [connection for connection in instance.connections if connection.interface != "power"]
+
+    verilog_snippet: List[str] = [
+        f"// blackbox of {instance.description}",
+        "`default_nettype none",
+        "(* blackbox *)",
+        f"module {instance.module} (",
+    ]
+    for number, connection in enumerate(others):
+        width = f"[{connection.width - 1}:0] " if connection.width > 1 else ""
+        comma = ", " if number > 0 else ""
+        verilog_snippet.append(f"    {comma}inout wire {width}{connection.port}")
+    if len(power):
+        verilog_snippet.append("`ifdef USE_POWER_PINS")
+        for number, connection in enumerate(power):
+            comma = ", " if number > 0 or len(others) else ""
+            verilog_snippet.append(f"    {comma}inout wire {connection.port}")
+        verilog_snippet.append("`endif")
+    verilog_snippet.append(");")
+    verilog_snippet.append("endmodule")
+    verilog_snippet.append("`default_nettype wire")
+    return "\n".join(verilog_snippet) + "\n"
+
+def generate_openlane_user_project_wrapper(model: WrapperModel) -> str:
     verilog_snippets: List[str] = []
 
     ### generate header ###
-    codegen_dir = os.path.dirname(os.path.realpath(__file__))
-    with open(os.path.join(codegen_dir, "caravel_iface_header.txt"), "r") as f:
-        for line in f.read().split("\n"):
-            verilog_snippets.append(line)
+    verilog_snippets += read_template("caravel_iface_header.txt").split("\n")
     verilog_snippets.append("")
 
     ### include openram stuff ###
-    codegen_dir = os.path.dirname(os.path.realpath(__file__))
-    if openram:
-        with open(os.path.join(codegen_dir, "caravel_iface_openram.txt"), "r") as f:
-            for line in f.read().split("\n"):
-                verilog_snippets.append(line)
+    if model.openram:
+        verilog_snippets += read_template("caravel_iface_openram.txt").split("\n")
 
     ### generate project includes ###
 
     verilog_snippets.append("    // start of user project module instantiation")
-    for project in projects:
-        verilog_snippets.append(
-            generate_openlane_user_project_wrapper_instance(
-                project.module_name,
-                project.id,
-                project.instance_name,
-                project.interfaces,
-                interface_definitions,
-                config,
-                openram
-            )
-        )
+    for instance in model.instances:
+        verilog_snippets.append(generate_openlane_user_project_wrapper_instance(instance))
     
     ### append footer ###
     verilog_snippets.append("    // end of module instantiation")
@@ -151,92 +175,129 @@ def generate_openlane_user_project_wrapper(projects, interface_definitions, outf
     verilog_snippets.append("endmodule	// user_project_wrapper")
     verilog_snippets.append("`default_nettype wire")
 
-    with open(outfile, "w") as f:
-        f.write("\n".join(verilog_snippets))
-
-def generate_openlane_user_project_wrapper_instance(
-    macro_name: str,
-    macro_id: str,    
-    macro_instance_name: str,
-    interfaces: List[str],
-    interface_defs: Dict[str, Dict[str, int]],
-    config,
-    openram
-) -> str:
-    verilog_name = macro_name
-    
-    verilog_snippet: List[str] = []
-    verilog_snippet.append(f"    {verilog_name} {macro_instance_name}(")
+    return "\n".join(verilog_snippets)
 
-    
-    for macro_interface in interfaces:
-        if macro_interface == "power":
-            verilog_snippet.append("        `ifdef USE_POWER_PINS")
-
-        for wire_name, width in interface_defs[macro_interface].items():
-            dst_wire_name = wire_name
-            if openram:
-                # translate the signal names so the wb_bridge is used
-                if wire_name in config['openram_support']['wb_uprj_bus']:
-                    dst_wire_name = config['openram_support']['wb_uprj_bus'][wire_name]
-
-            if wire_name == "active":
-                verilog_snippet.append(f"        .{wire_name} ({dst_wire_name}[{macro_id}]),")
-            elif width == 1:
-                verilog_snippet.append(f"        .{wire_name} ({dst_wire_name}),")
-            else:
-                verilog_snippet.append(f"        .{wire_name} ({dst_wire_name}[{width - 1}:0]),")
-
-        if macro_interface == "power":
-            verilog_snippet.append("        `endif")
+def generate_openlane_user_project_wrapper_instance(instance: Instance) -> str:
+    verilog_snippet: List[str] = []
+    verilog_snippet.append(f"    {instance.module} {instance.name}(")
+
+    last_port = 0
+    interface = None
+    for connection in instance.connections:
+        # power pins are only connected when USE_POWER_PINS is defined
+        if connection.interface != interface:
+            if interface == "power":
+                verilog_snippet.append("        `endif")
+            if connection.interface == "power":
+                verilog_snippet.append("        `ifdef USE_POWER_PINS")
+            interface = connection.interface
+        verilog_snippet.append(f"        .{connection.port} ({connection.net}),")
+        last_port = len(verilog_snippet) - 1
+    if interface == "power":
+        verilog_snippet.append("        `endif")
 
     # werilog likes complaining about trailing commas, remove the last one
-    verilog_snippet[-1] = verilog_snippet[-1][:-1]
+    verilog_snippet[last_port] = verilog_snippet[last_port][:-1]
 
     verilog_snippet.append(f"    );")
     verilog_snippet.append("")
 
     return "\n".join(verilog_snippet)
 
-def generate_sby_file(projects, shared_projects):
+def generate_macro_cfg(model: WrapperModel) -> str:
+    return ''.join("%s %.2f %.2f %s\n" % (instance.name, *instance.pos) for instance in model.macros)
+
+def generate_sby_file(model: WrapperModel) -> str:
     sby: List[str] = []
-    codegen_dir = os.path.dirname(os.path.realpath(__file__))
-    with open(os.path.join(codegen_dir, "tristate.sby"), "r") as f:
-        for line in f.read().split("\n"):
-
-            if line == '#DESIGNSCRIPT':
-                for project in projects:
-                    sby.append("# %s" % project)
-                    sby.append("read -noverific")
-                    sby.append("read -sv defines.v")
-                    sby.append("read -define FORMAL_COMPAT")
-                    sby.append("")
-
-                    for source in project.get_module_source_paths(absolute=False, caravel=True):
-                        sby.append("read -sv %s" % (source))
-
-                    sby.append("")
-                    sby.append("prep -top %s" % project.module_name)
-                    sby.append("flatten")
-                    sby.append("")
-                    sby.append("design -stash %s" % project.module_name)
-                    sby.append("# end")
-
-            elif line == '#SHAREDFILES':
-                for project in shared_projects:
-                    for source in project.get_module_source_paths(absolute=False, caravel=True):
-                        sby.append("read -sv %s" % (source))
-
-            elif line == '#DESIGNIMPORT':
-                for project in projects:
-                    sby.append("design -import %s" % project.module_name)
-
-            else:
-                sby.append(line)
-   
-            
+    for line in read_template("tristate.sby").split("\n"):
+
+        if line == '#DESIGNSCRIPT':
+            for instance in model.instances:
+                sby.append("# %s" % instance.description)
+                sby.append("read -noverific")
+                sby.append("read -sv defines.v")
+                sby.append("read -define FORMAL_COMPAT")
+                sby.append("")
+
+                for source in instance.caravel_sources():
+                    sby.append("read -sv %s" % (source))
+
+                sby.append("")
+                sby.append("prep -top %s" % instance.module)
+                sby.append("flatten")
+                sby.append("")
+                sby.append("design -stash %s" % instance.module)
+                sby.append("# end")
+
+        elif line == '#SHAREDFILES':
+            for instance in model.shared_instances:
+                for source in instance.caravel_sources():
+                    sby.append("read -sv %s" % (source))
+
+        elif line == '#DESIGNIMPORT':
+            for instance in model.instances:
+                sby.append("design -import %s" % instance.module)
+
+        else:
+            sby.append(line)
+
+    return "\n".join(sby)
+
+# one proof per macro: the macro is put in a harness where every wire it connects to also has a second driver that
+# is only enabled when the macro isn't active. tribuf -formal then asserts that the two never drive at the same time
+def generate_macro_sby_file(instance: Instance) -> str:
+    sby: List[str] = []
+    for line in read_template("tristate_macro.sby").split("\n"):
+
+        if line == '#DESIGNFILES':
+            sby.append("# %s" % instance.description)
+            for source in instance.caravel_sources():
+                sby.append("read -sv %s" % (source))
+
+        elif line == '#HARNESS':
+            sby.append(generate_tristate_harness(instance))
+
+        else:
+            sby.append(line)
+
     return "\n".join(sby)
 
+def generate_tristate_harness(instance: Instance) -> str:
+    ports: List[str] = ["    input wire active"]
+    body: List[str] = []
+    connections: List[str] = []
+
+    for connection in instance.connections:
+        # power pins aren't connected in the proof, same as the wrapper
+        if connection.interface == "power":
+            continue
+
+        wire_name, width = connection.port, connection.width
+        if wire_name == "active":
+            connections.append(f"        .{wire_name} (active)")
+            continue
+
+        # the shared wires are outputs of the harness, otherwise the whole design is optimised away
+        ports.append(f"    input wire [{width - 1}:0] {wire_name}_other")
+        ports.append(f"    output wire [{width - 1}:0] {wire_name}")
+        body.append(f"    assign {wire_name} = active ? {width}'bz : {wire_name}_other;")
+        connections.append(f"        .{wire_name} ({wire_name})")
+
+    harness: List[str] = []
+    harness.append(f"// {instance.description}")
+    harness.append("`default_nettype none")
+    harness.append("module tristate_harness(")
+    harness.append(",\n".join(ports))
+    harness.append(");")
+    harness += body
+    harness.append("")
+    harness.append(f"    {instance.module} {instance.name}(")
+    harness.append(",\n".join(connections))
+    harness.append("    );")
+    harness.append("endmodule")
+
+    return "\n".join(harness)
+
 """
 now that config is .json file, and there is no support for sourcing separate files,
 the single config has to contain all of the previously separate configs:
@@ -253,18 +314,17 @@ import json
 
 class json_config():
 
-    def __init__(self, projects):
-        config_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'openlane_config.json')
-        with open(config_file) as fh:
-            self.openlane_config = json.load(fh)
-        self.projects = projects
-
-    def write_config(self, destination):
-        for project in self.projects:
-            #self.openlane_config['FP_PDN_MACRO_HOOKS'] = [f'{project.instance_name} vccd1 vssd1 vccd1 vssd1' for project in self.projects]
-            self.openlane_config['FP_PDN_MACRO_HOOKS'] = ", ".join([f'{project.instance_name} vccd1 vssd1 vccd1 vssd1' for project in self.projects])
-            self.openlane_config['EXTRA_GDS_FILES']    = [f'dir::../../gds/{os.path.basename(project.gds_filename)}' for project in self.projects]
-            self.openlane_config['EXTRA_LEFS']         = [f'dir::../../lef/{os.path.basename(project.lef_filename)}' for project in self.projects]
-
-        with open(destination, 'w') as fh:
-            fh.write(json.dumps(self.openlane_config, indent=4))
+    def __init__(self, model: WrapperModel):
+        self.openlane_config = json.loads(read_template('openlane_config.json'))
+        self.model = model
+
+    # the macros' power hooks, GDS and LEF files, each built once from the instances
+    def generate_config(self) -> str:
+        instances = self.model.instances
+        self.openlane_config['FP_PDN_MACRO_HOOKS'] = ", ".join(instance.power_hook() for instance in instances)
+        self.openlane_config['EXTRA_GDS_FILES']    = [f'dir::../../gds/{instance.gds}' for instance in instances]
+        self.openlane_config['EXTRA_LEFS']         = [f'dir::../../lef/{instance.lef}' for instance in instances]
+        return json.dumps(self.openlane_config, indent=4)
+
+    def write_config(self, destination: str) -> bool:
+        return write_if_changed(destination, self.generate_config())
@@ -0,0 +1,120 @@
+import os
+import logging
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional, Tuple
+
+# the user_project_wrapper as data: the macros, how each one is wired, where it goes and which files it needs.
+# it is built once from the projects and every generated file is written from it
+
+@dataclass
+class Connection:
+    interface: str
+    port: str
+    width: int
+    net: str            # the wrapper net, including the bit select
+
+@dataclass
+class Instance:
+    module: str
+    name: str
+    id: Optional[int]   # None for shared projects
+    description: str    # str(project), used in comments
+    directory: str      # the project's directory name in caravel's verilog/rtl
+    connections: List[Connection]
+    sources: List[str]  # relative to the project directory
+    top_source: Optional[str]
+    pos: Tuple[float, float, str]
+    gds: str
+    lef: str
+    gl: str             # the powered netlist, as copied to caravel's verilog/gl
+    # for the includes table
+    title: str = ""
+    author: str = ""
+    repo: str = ""
+    commit: str = ""
+
+    # where the sources are once copied to caravel's verilog directory
+    def caravel_sources(self) -> List[str]:
+        return [os.path.join('rtl', self.directory, path) for path in self.sources]
+
+    # connects the macro's power pins to the wrapper's in the PDN
+    def power_hook(self) -> str:
+        return f"{self.name} vccd1 vssd1 vccd1 vssd1"
+
+@dataclass
+class WrapperModel:
+    instances: List[Instance] = field(default_factory=list)
+    shared_instances: List[Instance] = field(default_factory=list)
+    openram: bool = False
+
+    @property
+    def macros(self) -> List[Instance]:
+        return self.instances + self.shared_instances
+
+# the wrapper net that a macro's port connects to
+def connection_net(wire_name: str, width: int, macro_id, bus_renames: Dict[str, str]) -> str:
+    # with openram the wishbone goes through the bridge, so the signal names are translated
+    dst_wire_name = bus_renames.get(wire_name, wire_name)
+    if wire_name == "active":
+        return f"{dst_wire_name}[{macro_id}]"
+    if width == 1:
+        return dst_wire_name
+    return f"{dst_wire_name}[{width - 1}:0]"
+
+def build_instance(project, connections: List[Connection], macro_id, top_source) -> Instance:
+    return Instance(
+        module=project.module_name,
+        name=project.instance_name,
+        id=macro_id,
+        description=str(project),
+        directory=os.path.basename(project.directory),
+        connections=connections,
+        sources=project.get_module_source_paths(absolute=False),
+        top_source=top_source,
+        pos=project.get_macro_pos(),
+        gds=os.path.basename(project.gds_filename),
+        lef=os.path.basename(project.lef_filename),
+        gl=os.path.basename(project.config['final'].get('lvs_filename', '')),
+        title=project.title,
+        author=project.author,
+        repo=project.repo,
+        commit=project.commit,
+    )
+
+# a macro with all its interfaces connected
+def build_project_instance(project, interface_definitions: Dict[str, Dict[str, int]], bus_renames: Dict[str, str]) -> Instance:
+    connections: List[Connection] = []
+    for macro_interface in project.interfaces:
+        for wire_name, width in interface_definitions[macro_interface].items():
+            net = connection_net(wire_name, width, project.id, bus_renames)
+            connections.append(Connection(macro_interface, wire_name, width, net))
+    return build_instance(project, connections, project.id, project.get_top_module())
+
+def build_wrapper_model(projects, shared_projects, interface_definitions: Dict[str, Dict[str, int]], openram, config) -> WrapperModel:
+    bus_renames: Dict[str, str] = config['openram_support']['wb_uprj_bus'] if openram else {}
+    model = WrapperModel(openram=bool(openram))
+
+    for project in projects:
+        model.instances.append(build_project_instance(project, interface_definitions, bus_renames))
+
+    # the shared projects are wired up by hand in the openram template
+    for project in shared_projects:
+        model.shared_instances.append(build_instance(project, [], None, None))
+
+    check_wrapper_model(model)
+    return model
+
+# instance names and ids must be unique, checked with sets so it stays quick with many macros
+def check_wrapper_model(model: WrapperModel) -> None:
+    names = set()
+    ids = set()
+    for instance in model.macros:
+        if instance.name in names:
+            logging.error(f"instance name {instance.name} is used more than once")
+            exit(1)
+        names.add(instance.name)
+        if instance.id is not None:
+            if instance.id in ids:
+                logging.error(f"project id {instance.id} is used more than once")
+                exit(1)
+            ids.add(instance.id)
@@ -0,0 +1,21 @@
+import logging
+import os
+
+# generated files are only written when their contents change, so an unchanged file keeps its mtime and make/OpenLane don't redo work.
+# returns True if the file was written
+def write_if_changed(path: str, content: str) -> bool:
+    try:
+        with open(path, "r") as f:
+            if f.read() == content:
+                logging.info(f"{path} unchanged")
+                return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+
+    # write then rename, so nothing ever reads a half written file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    logging.info(f"wrote {path}")
+    return True
@@ -1,13 +1,32 @@
 from utils import *
 import subprocess
 import copy
-from project import Project, SharedProject
-from codegen.caravel_codegen import generate_openlane_files, generate_sby_file, json_config
+import time
+import functools
+import csv
+import json
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from tabulate import tabulate
+from project import Project, SharedProject, SHARED_RESOURCES
+from scheduler import Scheduler, Task, PASS, FAIL, CACHED, results_matrix, results_summary, write_results
+from cache import ResultCache, hash_file, get_tool_version
+from netlist import cell_category
+from sync import Syncer
+from instrument import stage
+from simlib import BUFFERTEST_DIR, write_tristate_report
+from codegen.caravel_codegen import generate_openlane_files, generate_gl_files, generate_sby_file, generate_macro_sby_file, generate_macro_cfg, json_config
+from codegen.model import build_wrapper_model, build_project_instance
 from codegen.allocator import allocate_macros
+from codegen.output import write_if_changed
+from dag import StampedTask
+from render import Renderer, add_tile_pyramid
 from urllib.parse import urlparse
 
 REQUIRED_KEYS_GROUP = ["interfaces", "openram_support", "configuration", "docs", "projects"]
 REQUIRED_KEYS_LOCAL = ["project_directory", "caravel", "env"]
+REQUIRED_KEYS_PROJECT = ["repo", "commit", "pos"]
+
+CELL_REPORT_CATEGORIES = ['logic', 'buffer', 'tap', 'diode', 'fill', 'decap']
 
 def merge_two_dicts(x, y):
     z = x.copy()   # start with keys and values of x
@@ -27,27 +46,59 @@ class Collection(object):
 
         self.config = merge_two_dicts(project_config, local_config)
         self.projects = []
+        # the tasks run by this collection, with their results
+        self.results = []
 
         if not (0 < len(self.config['projects']) <= 16):
             logging.error("bad number of projects - must be > 0 and <= 16")
             exit(1)
 
+        errors = []
+        for name, project_info in self.config['projects'].items():
+            errors += missing_keys(project_info, REQUIRED_KEYS_PROJECT, "project %s in %s" % (name, args.config))
+        if args.openram:
+            for name, project_info in self.config['openram_support']['projects'].items():
+                errors += missing_keys(project_info, REQUIRED_KEYS_PROJECT, "shared project %s in %s" % (name, args.config))
+        for error in errors:
+            logging.error(error)
+        if len(errors):
+            exit(1)
+
+        # clone everything up front, in parallel
+        clone_infos = []
+        if args.clone_repos:
+            clone_infos += self.config['projects'].values()
+        if args.openram and args.clone_shared_repos:
+            clone_infos += self.config['openram_support']['projects'].values()
+        if len(clone_infos):
+            self.clone_all_repos(clone_infos)
+
         # build the list of projects
+        projects = []
         for project_info in self.config['projects'].values():
             repo = project_info["repo"]
-            try:
-                directory = project_info["dir"]
-            except KeyError:
-                # the project's directory is made by joining project dir to last part of the repo url 
-                parsed = urlparse(repo)
-                directory = parsed.path.rpartition('/')[-1]
-            directory = os.path.join(self.config['project_directory'], directory)
+            directory = self.get_project_directory(project_info)
             commit = project_info["commit"]
             pos = project_info["pos"]
             
             required_interfaces = list(self.config['interfaces']['required'].keys())
-            project = Project(args, repo, directory, commit, pos, required_interfaces, self.config)
+            projects.append(Project(args, repo, directory, commit, pos, required_interfaces, self.config, project_info.get("id")))
 
+        self.shared_projects = []
+        if self.args.openram:
+            for project_info in self.config['openram_support']['projects'].values():
+                repo = project_info["repo"]
+                directory = self.get_project_directory(project_info)
+                commit = project_info["commit"]
+                pos = project_info["pos"]
+                project = SharedProject(args, repo, directory, commit, pos, self.config)
+                self.shared_projects.append(project)
+
+        # the filters below read the ids, which stops at the first bad info.yaml. so with --check-config all of them are read first
+        if args.check_config:
+            self.check_config(projects + self.shared_projects)
+
+        for project in projects:
             # if --project is given, skip others
             if self.args.project is not None:
                 if self.args.project != project.id:
@@ -60,25 +111,6 @@ class Collection(object):
 
             # append
             self.projects.append(project)
-   
-
-        self.shared_projects = []
-        if self.args.openram:
-            for project_info in self.config['openram_support']['projects'].values():
-                directory = None
-                repo = project_info["repo"]
-                try:
-                    directory = project_info["dir"]
-                except KeyError:
-                    # the project's directory is made by joining project dir to last part of the repo url 
-                    parsed = urlparse(repo)
-                    directory = parsed.path.rpartition('/')[-1]
-                directory = os.path.join(self.config['project_directory'], directory)
-                commit = project_info["commit"]
-                pos = project_info["pos"]
-                project = SharedProject(args, repo, directory, commit, pos, self.config)
-                self.shared_projects.append(project)
-                logging.info(project)
             
         # fill space with duplicated projects
         if args.fill and args.fill > len(self.projects):
@@ -106,88 +138,348 @@ class Collection(object):
             **self.config['interfaces']['optional']
         }
 
+    # the stages of a pipeline each have their own options, but use the same projects
+    def set_args(self, args):
+        self.args = args
+        for project in self.projects + self.shared_projects:
+            project.args = args
+
+    def get_project_directory(self, project_info):
+        try:
+            directory = project_info["dir"]
+        except KeyError:
+            # the project's directory is made by joining project dir to last part of the repo url 
+            parsed = urlparse(project_info["repo"])
+            directory = parsed.path.rpartition('/')[-1]
+        return os.path.join(self.config['project_directory'], directory)
+
+    # read every project's info.yaml and report all the problems at once, instead of stopping at the first
+    def check_config(self, projects):
+        errors = []
+        ids = {}
+        for project in projects:
+            config, project_errors = project.read_config()
+            if len(project_errors):
+                errors += project_errors
+                continue
+            project._config = config
+            if isinstance(project, Project):
+                if project.id in ids:
+                    errors.append("project id %d is used by both %s and %s" % (project.id, ids[project.id].directory, project.directory))
+                ids[project.id] = project
+
+        for error in errors:
+            logging.error(error)
+        if len(errors):
+            logging.error("%d config errors" % len(errors))
+            exit(1)
+        logging.info("config of %d projects is valid" % len(projects))
+
+    # shallow fetch of the pinned commits, several repos at a time. If git_cache is set in the local config, objects are kept there and shared between shuttles
+    def clone_all_repos(self, project_infos):
+        git_cache = self.config.get('git_cache')
+        with ThreadPoolExecutor(max_workers=self.args.jobs or 8) as pool:
+            futures = {}
+            for project_info in project_infos:
+                directory = self.get_project_directory(project_info)
+                future = pool.submit(self.clone_repo, project_info, directory, git_cache)
+                futures[future] = project_info["repo"]
+
+        failed = []
+        for future, repo in futures.items():
+            try:
+                future.result()
+            # anything that goes wrong with one repo, eg a directory that isn't a repo, is reported along with the others
+            except Exception as e:
+                logging.error("failed to clone %s: %s: %s" % (repo, type(e).__name__, e))
+                failed.append(repo)
+
+        if len(failed):
+            logging.error("%d repos failed to clone" % len(failed))
+            exit(1)
+
+    def clone_repo(self, project_info, directory, git_cache):
+        with stage(os.path.basename(directory), 'clone'):
+            clone_repo(project_info["repo"], project_info["commit"], directory, self.args.force_delete, git_cache)
+
+    # ports are read from the source directly, only the projects that need the yosys fallback take any time so run those in parallel
+    def extract_all_ports(self):
+        def get_ports(project):
+            try:
+                project.get_ports()
+            except Exception as e:
+                # validate_ports will report it
+                logging.warning("couldn't get ports of %s: %s" % (project, e))
+
+        with ThreadPoolExecutor(max_workers=self.args.jobs or 8) as pool:
+            list(pool.map(get_ports, [project for project in self.projects if 'waive_ports_test' not in project.config['project']]))
+
     def run_tests(self):
+        if self.args.test_all or self.args.test_ports or self.args.test_tristate_z:
+            self.extract_all_ports()
+
+        try:
+            self.run_checks()
+        finally:
+            write_tristate_report(os.path.join(BUFFERTEST_DIR, 'build', 'results.json'))
+
+    # without --jobs the checks run one at a time with their output on the console and stop at the first failure, as before.
+    # with --jobs each check gets its own log and a failure doesn't stop the others. --fail-fast and --keep-going choose either way
+    @property
+    def fail_fast(self):
+        if self.args.fail_fast or self.args.keep_going:
+            return bool(self.args.fail_fast)
+        return self.args.jobs is None
+
+    def run_checks(self):
+        tasks = []
         for project in self.projects + self.shared_projects:
-            project.run_tests()
+            project.log_info()
+            for name, check in project.get_checks():
+                tasks.append(Task(project, name, functools.partial(project.run_check, name, check), SHARED_RESOURCES.get(name)))
+
+        if len(tasks) == 0:
+            return
+
+        if self.args.jobs is None:
+            scheduler = Scheduler(1, None, self.fail_fast)
+        else:
+            scheduler = Scheduler(self.args.jobs, self.args.log_dir, self.fail_fast, self.resource_limits())
+        self.finish_tasks(scheduler.run(tasks), 'checks')
+
+    # each caravel simulation is independent, but they need a lot of memory
+    def resource_limits(self):
+        return {'caravel_sim': self.args.caravel_jobs or self.args.jobs or os.cpu_count()}
+
+    # the exit status is from all the tasks, so one run finds every failure
+    def finish_tasks(self, tasks, description):
+        self.results += tasks
+        if self.args.results:
+            write_results(self.results, self.args.results)
+
+        logging.info("%s results:\n%s" % (description, results_matrix(tasks)))
+        logging.info("%s: %s" % (description, results_summary(tasks)))
+        failed = [task for task in tasks if task.status == FAIL]
+        if len(failed):
+            logging.error("%d of %d %s failed" % (len(failed), len(tasks), description))
+            exit(1)
+
+    # the selected actions as a graph of tasks, see dag.py. each project's steps start as soon as the steps they need are done,
+    # steps whose inputs haven't changed since they last passed are skipped, and a failed step only stops the steps that need it
+    def build_flow(self):
+        cache = ResultCache(self.args.cache_dir, enabled=not self.args.no_cache)
+        projects = self.projects + self.shared_projects
+        tasks = []
+        def add(task):
+            tasks.append(task)
+            return task
+
+        # loads what later steps need, and they get it from the project. the task only needs to know it worked
+        def load(func):
+            def run():
+                func()
+            return run
+
+        ports = {}
+        modules = {}
+        copies = {}
+        gds = {}
+        for project in projects:
+            if isinstance(project, Project) and 'waive_ports_test' not in project.config['project'] and \
+                    (self.args.test_all or self.args.test_ports or self.args.test_tristate_z):
+                ports[project] = add(Task(project, 'ports', load(project.get_ports)))
+
+            # the wrapper needs every project's top module
+            if self.args.create_openlane_config:
+                modules[project] = add(Task(project, 'modules', load(project.get_module_index)))
+
+            if self.args.copy_project:
+                rtl_dst = os.path.join(self.config['caravel']['rtl_dir'], os.path.basename(project.directory))
+                copies[project] = add(StampedTask(project, 'copy_project', functools.partial(self.sync_project_files, project), cache,
+                    [project.directory], [rtl_dst], extra=self.args.link))
+
+            if self.args.copy_gds:
+                gds_copies = self.gds_copies(project)
+                inputs = [src for src, dst in gds_copies] + ([project.netlist_filename] if isinstance(project, Project) else [])
+                gds[project] = add(StampedTask(project, 'copy_gds', functools.partial(self.sync_project_gds, project), cache,
+                    inputs, [dst for src, dst in gds_copies], extra=self.args.link))
+
+        allocate = [add(Task(None, 'allocate', self.allocate_macros))] if self.args.allocate else []
+        openlane_config = []
+        if self.args.create_openlane_config:
+            openlane_config = [add(Task(None, 'openlane_config', load(self.create_openlane_config), deps=allocate + list(modules.values())))]
+
+        for project in projects:
+            for name, check in project.get_checks():
+                deps = []
+                if name in ('validate_ports', 'test_tristate_z') and project in ports:
+                    deps.append(ports[project])
+                # the caravel simulation includes every macro. at gate level the others are blackboxes, so only this project's netlist is needed
+                if name == 'test_caravel':
+                    if self.args.gate_level:
+                        deps += openlane_config + [copies[dep] for dep in copies if dep is project or isinstance(dep, SharedProject)] + \
+                            ([gds[project]] if project in gds else [])
+                    else:
+                        deps += openlane_config + list(copies.values())
+                add(Task(project, name, functools.partial(project.run_check, name, check), SHARED_RESOURCES.get(name), deps))
+
+            # the proof uses the sources as copied to caravel
+            if self.args.prove_tristate and isinstance(project, Project):
+                add(Task(project, 'prove_tristate', functools.partial(self.prove_tristate, project), deps=[copies[project]] if project in copies else []))
+
+        if self.args.prove_tristate_combined:
+            add(Task(None, 'prove_tristate_combined', self.prove_combined_tristate, deps=openlane_config + list(copies.values())))
+        if self.args.generate_doc:
+            add(Task(None, 'generate_doc', self.generate_docs))
+        if self.args.annotate_image:
+            add(Task(None, 'annotate_image', self.annotate_image, deps=allocate))
+        if self.args.dump_macro_position:
+            add(Task(None, 'dump_macro_position', self.get_macro_pos, deps=allocate))
+        if self.args.count_cells:
+            add(Task(None, 'count_cells', self.count_cells))
+        return tasks
+
+    def run_flow(self):
+        tasks = self.build_flow()
+        if len(tasks) == 0:
+            return
+
+        # the flow keeps going unless --fail-fast is given, --jobs only changes how many tasks run at once
+        scheduler = Scheduler(self.args.jobs or os.cpu_count(), self.args.log_dir, bool(self.args.fail_fast), self.resource_limits())
+        try:
+            scheduler.run(tasks)
+        finally:
+            write_tristate_report(os.path.join(BUFFERTEST_DIR, 'build', 'results.json'))
+        self.finish_tasks(tasks, 'flow tasks')
+
+    # in the flow, copies only change what is different
+    def sync_project_files(self, project):
+        syncer = Syncer(self.args.jobs, self.args.link)
+        project.copy_project_files_to_caravel(syncer)
+        syncer.finish()
+
+    def sync_project_gds(self, project):
+        syncer = Syncer(self.args.jobs, self.args.link)
+        self.copy_project_gds(project, syncer)
+        syncer.finish()
 
     def count_cells(self):
-        total_cells = 0
-        for project in self.projects + self.shared_projects:
-            cells = project.count_cells()
-            logging.info("%40s %10d cells" % (project.title, cells))
-            total_cells += cells
-        logging.info("total standard cells = %s" % total_cells)
-        
+        projects = self.projects + self.shared_projects
+        # scanning is cpu bound so done in separate processes, the threads just wait on them and use the cache
+        with ProcessPoolExecutor(max_workers=self.args.jobs) as processes, ThreadPoolExecutor(max_workers=len(projects) or 1) as threads:
+            summaries = list(threads.map(lambda project: project.count_cells(processes), projects))
+
+        table = []
+        for project, summary in zip(projects, summaries):
+            categories = summary['categories']
+            table.append([project.title, summary['total']] + [categories.get(category, 0) for category in CELL_REPORT_CATEGORIES] + [summary['area']])
+        table.append(['total', sum(summary['total'] for summary in summaries)] + [sum(summary['categories'].get(category, 0) for summary in summaries) for category in CELL_REPORT_CATEGORIES] + [sum(summary['area'] or 0 for summary in summaries)])
+        logging.info("standard cells:\n%s" % tabulate(table, headers=['project', 'cells'] + CELL_REPORT_CATEGORIES + ['area um^2'], floatfmt='.0f'))
+
+        if self.args.cell_report:
+            self.write_cell_report(projects, summaries, self.args.cell_report)
+
+    # csv has one row per project and cell type, json has the whole summary of each project
+    def write_cell_report(self, projects, summaries, filename):
+        logging.info("writing cell report to %s" % filename)
+        if filename.endswith('.csv'):
+            with open(filename, 'w', newline='') as fh:
+                writer = csv.writer(fh)
+                writer.writerow(['project', 'cell', 'category', 'count'])
+                for project, summary in zip(projects, summaries):
+                    for cell_type, count in summary['cells'].items():
+                        writer.writerow([project.instance_name, cell_type, cell_category(cell_type), count])
+        else:
+            with open(filename, 'w') as fh:
+                json.dump({project.instance_name: summary for project, summary in zip(projects, summaries)}, fh, indent=2)
 
     # TODO refactor so project konws how to copy gds and lef, then do the same as rtl, gl, test etc.
     def copy_all_gds(self):
-        macros_dir = os.path.join(self.config['caravel']['root'], 'openlane', 'user_project_wrapper', 'macros', 'lef')
-        lef_dir = os.path.join(self.config['caravel']['root'], 'lef')
-        gds_dir = os.path.join(self.config['caravel']['root'], 'gds')
-
+        # copies are done in parallel, and with --sync only files that have changed are copied
+        syncer = Syncer(self.args.jobs, self.args.link, force=not self.args.sync)
         for project in self.projects + self.shared_projects:
-            # gds
-            src = os.path.join(project.directory, project.gds_filename)
-            dst = os.path.join(gds_dir, os.path.basename(project.gds_filename))
-            logging.info("copying %s to %s" % (src, dst))
-            shutil.copyfile(src, dst)
-
-            # lef
-            src = os.path.join(project.directory, project.lef_filename)
-            dst = os.path.join(lef_dir, os.path.basename(project.lef_filename))
-            logging.info("copying %s to %s" % (src, dst))
-            shutil.copyfile(src, dst)
-
-            # gl
-            project.copy_gl()
-
-            # spef, sdc, sdc files
-            for optional_file_type in ["spef", "sdc", "sdf"]:
-                dst_dir = os.path.join(self.config['caravel']['root'], optional_file_type)
-                if not os.path.exists(dst_dir):
-                    os.mkdir(dst_dir)
-                filename = project.get_optional_file(optional_file_type)
-                if filename is not None:
-                    src = filename
-                    dst = os.path.join(self.config['caravel']['root'], optional_file_type, os.path.basename(filename))
-                    logging.info("copying optional file to %s" % dst)
-                    shutil.copyfile(src, dst)
+            self.copy_project_gds(project, syncer)
+        syncer.finish()
 
+    # (src, dst) of the gds, lef and the spef, sdc, sdf files that the project has
+    def gds_copies(self, project):
+        lef_dir = os.path.join(self.config['caravel']['root'], 'lef')
+        gds_dir = os.path.join(self.config['caravel']['root'], 'gds')
+        copies = [
+            (os.path.join(project.directory, project.gds_filename), os.path.join(gds_dir, os.path.basename(project.gds_filename))),
+            (os.path.join(project.directory, project.lef_filename), os.path.join(lef_dir, os.path.basename(project.lef_filename))),
+            ]
+        for optional_file_type in ["spef", "sdc", "sdf"]:
+            filename = project.get_optional_file(optional_file_type)
+            if filename is not None:
+                copies.append((filename, os.path.join(self.config['caravel']['root'], optional_file_type, os.path.basename(filename))))
+        return copies
+
+    def copy_project_gds(self, project, syncer):
+        for src, dst in self.gds_copies(project):
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            syncer.copy(src, dst)
+
+        # gl
+        project.copy_gl(syncer)
 
     def copy_all_project_files_to_caravel(self):
         ### copy out rtl ###
+        syncer = Syncer(self.args.jobs, self.args.link) if self.args.sync else None
         for project in self.projects + self.shared_projects:
-            project.copy_project_files_to_caravel()
+            project.copy_project_files_to_caravel(syncer)
+        if syncer is not None:
+            syncer.finish()
 
     def annotate_image(self):
         final_gds_file = os.path.join(self.config['caravel']['root'], 'gds', 'user_project_wrapper.gds.gz')
-        # dump a 2000x2000 image with klayout to pics/multi_macro.png, check the dump_pic.rb file
-        cmd = "klayout -l caravel.lyp %s -r dump_pic.rb -c klayoutrc" % final_gds_file
-        logging.info(cmd)
-        os.system(cmd)
-        image_file = os.path.join('pics', 'multi_macro.png')
+        if not os.path.exists(final_gds_file):
+            logging.error("%s not found, harden the user_project_wrapper first" % final_gds_file)
+            exit(1)
+        docs = self.config['docs']
+        pic_dir = docs.get('pic_dir', 'pics')
+        px_per_um = docs['px_per_um']
+        macro_border = docs['macro_border']
+        renderer = Renderer(final_gds_file, 'caravel.lyp', pic_dir, self.args.jobs)
+
+        # the 2000x2000 overview, centred on the user area
+        image_size = 2000
+        view_um = image_size / px_per_um
+        image_file = renderer.add('multi_macro.png', (self.width / 2 - view_um / 2, self.height / 2 - view_um / 2,
+            self.width / 2 + view_um / 2, self.height / 2 + view_um / 2), image_size, image_size)
+
+        # tiles to zoom into the whole wrapper, and a close up of each macro
+        add_tile_pyramid(renderer, (0, 0, self.width, self.height), docs.get('tile_size', 512), docs.get('max_px_per_um', 2))
+        crop_px_per_um = docs.get('crop_px_per_um', 2)
+        crop_border = macro_border / px_per_um
+        for project in self.projects + self.shared_projects:
+            macro_x, macro_y, orient = project.get_macro_pos()
+            macro_w, macro_h = project.get_macro_size()
+            box = (macro_x - crop_border, macro_y - crop_border, macro_x + macro_w + crop_border, macro_y + macro_h + crop_border)
+            renderer.add(os.path.join('macros', '%s.png' % project.instance_name), box,
+                (box[2] - box[0]) * crop_px_per_um, (box[3] - box[1]) * crop_px_per_um)
+
+        renderer.run()
+
         from PIL import Image, ImageFont, ImageDraw
         font_author = ImageFont.truetype("/usr/share/fonts/dejavu/DejaVuSans.ttf", 27)
         font_title = ImageFont.truetype("/usr/share/fonts/dejavu/DejaVuSans.ttf", 22)
         img = Image.open(image_file)
         draw = ImageDraw.Draw(img)
 
-        px_per_um = self.config['docs']['px_per_um']
-        macro_border = self.config['docs']['macro_border']
         user_width = self.width * px_per_um
         user_height = self.height * px_per_um
 
-        x_offset = (2000 - user_width) / 2
-        y_offset = (2000 - user_height) / 2
+        x_offset = (image_size - user_width) / 2
+        y_offset = (image_size - user_height) / 2
 
         logging.info("annotating image")
         for project in self.projects + self.shared_projects:
             logging.info(project)
             macro_x, macro_y, orient = project.get_macro_pos()
             x = x_offset + macro_x * px_per_um - macro_border
-            y = 2000 - (y_offset + macro_y * px_per_um - macro_border) # flip, gds is bottom left 0,0, png is top left 0,0
-            # takes a while
-            macro_w, macro_h = project.get_gds_size()
+            y = image_size - (y_offset + macro_y * px_per_um - macro_border) # flip, gds is bottom left 0,0, png is top left 0,0
+            macro_w, macro_h = project.get_macro_size()
             macro_w = macro_w * px_per_um + 2*macro_border
             macro_h = macro_h * px_per_um + 2*macro_border
 
@@ -199,9 +491,19 @@ class Collection(object):
             draw.line((x + macro_w, y - macro_h, x          , y - macro_h), fill=(0,0,0), width=2)
             draw.line((x          , y - macro_h, x          , y          ), fill=(0,0,0), width=2)
 
-        annotated_image_file = os.path.join('pics', 'multi_macro_annotated.png')
+        annotated_image_file = os.path.join(pic_dir, 'multi_macro_annotated.png')
         img.save(annotated_image_file)
 
+    # replace the positions from projects.yaml with ones from the allocator
+    def allocate_macros(self):
+        conf = self.config['configuration']
+        allocation = allocate_macros(self.width, self.height, conf.get('h_edge', 100), conf.get('v_edge', 100), conf['macro_snap'],
+            self.projects, self.args.allocate, self.args.openram, self.shared_projects, conf.get('macro_spacing', 40))
+        for project in self.projects:
+            x, y = allocation[project.id]
+            project.pos = "%.2f %.2f N" % (x, y)
+            logging.info("%-40s %s" % (project.instance_name, project.pos))
+
     def get_macro_pos(self):
         for project in self.projects + self.shared_projects:
             logging.info(project.get_macro_pos())
@@ -210,8 +512,50 @@ class Collection(object):
         for project in self.projects + self.shared_projects:
             logging.info(project.get_macro_pos_from_caravel())
 
+    # the same module in two projects would only fail later in simulation or synthesis, once all the sources are included together.
+    # projects repeated by --fill share a directory so are only counted once
+    def check_duplicate_modules(self):
+        declared = {}
+        for project in self.projects + self.shared_projects:
+            for path, modules in project.get_module_index().items():
+                for module in modules:
+                    declared.setdefault(module, {})[project.directory] = (project, path)
+
+        # the index is a quick scan that also finds modules in comments and `ifdefs that are off, so the projects with
+        # duplicates are preprocessed to see if they really declare them. if they can't be preprocessed the scan is trusted
+        preprocessed = {}
+        errors = 0
+        for module, sources in sorted(declared.items()):
+            if len(sources) < 2:
+                continue
+            confirmed = 0
+            for directory, (project, path) in sources.items():
+                if directory not in preprocessed:
+                    preprocessed[directory] = project.get_preprocessed_module_index()
+                if preprocessed[directory] is None or module in preprocessed[directory][path]:
+                    confirmed += 1
+
+            description = ', '.join("%s (%s)" % (project.title, path) for project, path in sources.values())
+            if confirmed > 1:
+                logging.error("module %s is declared by more than one project: %s" % (module, description))
+                errors += 1
+            else:
+                logging.warning("module %s is in more than one project, but in comments or `ifdefs that are off in all but one: %s" % (module, description))
+        if errors:
+            exit(1)
+
+    def get_wrapper_model(self):
+        return build_wrapper_model(self.projects, self.shared_projects, self.interface_definitions, self.args.openram, self.config)
+
     def create_openlane_config(self):
-        self.generate_macro_cfg()
+        self.check_duplicate_modules()
+        # everything is generated from one model of the wrapper
+        model = self.get_wrapper_model()
+        changed = []
+        macro_inst_file = os.path.join(self.config['caravel']['root'], 'openlane', 'user_project_wrapper', 'macro.cfg')
+        logging.info("generating macros.cfg: %s" % macro_inst_file)
+        if write_if_changed(macro_inst_file, generate_macro_cfg(model)):
+            changed.append(macro_inst_file)
 #        self.generate_extra_lef_gds_tcl()
 
         ### generate user wrapper verilog and include files ###
@@ -220,34 +564,34 @@ class Collection(object):
         caravel_includes_path =      os.path.join(self.config['caravel']['includes_dir'], "includes.rtl.caravel_user_project")
 #        obstruction_path = os.path.join(self.config['caravel']['root'], 'openlane', 'user_project_wrapper', "obstruction.tcl")
 #        macro_power_path = os.path.join(self.config['caravel']['root'], 'openlane', 'user_project_wrapper', "macro_power.tcl")
-        generate_openlane_files(
-            self.projects, 
-            self.shared_projects,
-            self.interface_definitions, 
+        changed += generate_openlane_files(
+            model,
             user_project_wrapper_path, 
             user_project_includes_path,
             caravel_includes_path,
 #            obstruction_path,
 #            macro_power_path,
-            self.args.openram,
-            self.args.gate_level,
-            self.config
         )
 
+        # an include file for each project's gate level simulation, with the other projects as blackboxes
+        if self.args.gate_level:
+            logging.info("generating gate level includes")
+            changed += generate_gl_files(model, self.config['caravel']['includes_dir'], self.config['caravel']['gl_dir'])
+
         # create the json config file
         dst = os.path.join(self.config['caravel']['root'], 'openlane', 'user_project_wrapper', 'config.json')
 
-        config = json_config(self.projects)
-        config.write_config(dst)
+        config = json_config(model)
+        if config.write_config(dst):
+            changed.append(dst)
+
+        # unchanged files keep their times, so make and OpenLane only redo what depends on the changed ones
+        if len(changed):
+            logging.info("%d generated files changed:\n%s" % (len(changed), '\n'.join(changed)))
+        else:
+            logging.info("no generated files changed")
+        return changed
 
-    def generate_macro_cfg(self):
-        macro_inst_file = os.path.join(self.config['caravel']['root'], 'openlane', 'user_project_wrapper', 'macro.cfg')
-        logging.info("overwriting macros.cfg: %s" % macro_inst_file)
-        with open(macro_inst_file, "w") as f:
-            for project in self.projects + self.shared_projects:
-                x, y, orient = project.get_macro_pos()
-                f.write("%s %.2f %.2f %s\n" % (project.instance_name, x, y, orient))
-            
     # want to put macros in top level dirs, so now need to generate a bit of tcl that adds the extra lef/def
     def generate_extra_lef_gds_tcl(self):
         extra_lef_gds_file = os.path.join(self.config['caravel']['root'], 'openlane', 'user_project_wrapper', 'extra_lef_gds.tcl')
@@ -316,11 +660,58 @@ The configuration files are [projects.yaml](projects.yaml) & [local.yaml](local.
 
         logging.info("wrote index.md")
 
+    # check each macro's tristate outputs separately, so the proofs can run in parallel and only changed designs are proved again
     def prove_all_tristate(self):
-        sby_file = generate_sby_file(self.projects, self.shared_projects)
+        tasks = [Task(project, 'prove_tristate', functools.partial(self.prove_tristate, project)) for project in self.projects]
+        scheduler = Scheduler(self.args.jobs or os.cpu_count(), self.args.log_dir, bool(self.args.fail_fast))
+        self.finish_tasks(scheduler.run(tasks), 'tristate proofs')
+
+        logging.info("tribuf proof pass")
+
+    def prove_tristate(self, project):
+        with stage(project.instance_name, 'prove_tristate') as record:
+            sby_file = generate_macro_sby_file(build_project_instance(project, self.interface_definitions, {}))
+            sby_name = "tribuf_%s.sby" % project.instance_name
+            sby_cmd = self.config.get('tools', {}).get('sby', 'sby')
+
+            # the proof only depends on the design's sources as copied to caravel, the harness and the tools
+            caravel_verilog = os.path.join(self.config['caravel']['root'], 'verilog')
+            try:
+                sources = [os.path.join(caravel_verilog, path) for path in project.get_module_source_paths(absolute=False, caravel=True)]
+                sources.append(os.path.join(self.config['caravel']['root'], 'caravel', 'verilog', 'rtl', 'defines.v'))
+                design_hash = {os.path.relpath(path, caravel_verilog): hash_file(path) for path in sources}
+            except FileNotFoundError as e:
+                logging.error("%s, use --copy-project to copy the design to caravel" % e)
+                exit(1)
+
+            cache = ResultCache(self.args.cache_dir, enabled=not self.args.no_cache)
+            key = cache.key('prove_tristate', design_hash, sby_file, get_tool_version(sby_cmd), get_tool_version('yosys'))
+            if cache.get('tristate', key) is not None:
+                logging.info("%s tristate proof cached" % project)
+                record['status'] = CACHED
+                return CACHED
+
+            with open(os.path.join(self.config['caravel']['root'], sby_name), 'w') as fh:
+                fh.write(sby_file)
+
+            cwd = self.config['caravel']['root']
+            cmd = [sby_cmd, "-f", sby_name]
+            logging.info("attempting to run %s in %s" % (cmd, cwd))
+            try:
+                run_cmd(cmd, cwd=cwd, check=True)
+            except subprocess.CalledProcessError as e:
+                logging.error(e)
+                exit(1)
+
+            cache.put('tristate', key, {'instance': project.instance_name, 'time': time.time()})
+            logging.info("%s tristate proof pass" % project)
+            return PASS
+
+    # the original proof of the whole user_project_wrapper in one go, also checks the wiring between the macros
+    def prove_combined_tristate(self):
+        sby_file = generate_sby_file(self.get_wrapper_model())
         logging.info("generated sby file")
-        with open(os.path.join(self.config['caravel']['root'], "tribuf.sby"), 'w') as fh:
-            fh.write(sby_file)
+        write_if_changed(os.path.join(self.config['caravel']['root'], "tribuf.sby"), sby_file)
 
         try:
             sby_cmd = self.config['tools']['sby']
@@ -331,10 +722,10 @@ The configuration files are [projects.yaml](projects.yaml) & [local.yaml](local.
         cmd = [sby_cmd, "-f", "tribuf.sby"]
         logging.info("attempting to run %s in %s" % (cmd, cwd))
         try:
-            subprocess.run(cmd, cwd=cwd, check=True)
+            with stage('user_project_wrapper', 'prove_tristate_combined'):
+                run_cmd(cmd, cwd=cwd, check=True)
         except subprocess.CalledProcessError as e:
             logging.error(e)
             exit(1)
 
         logging.info("tribuf proof pass")
-
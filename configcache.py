@@ -0,0 +1,93 @@
+import logging
+import os
+import pickle
+import threading
+import yaml
+from cache import hash_file
+
+# the C loader is much quicker on the larger info.yaml files, but isn't in every build of pyyaml
+try:
+    YamlLoader = yaml.CSafeLoader
+except AttributeError:
+    YamlLoader = yaml.SafeLoader
+
+# bump this if the format of the snapshot changes
+SNAPSHOT_VERSION = 1
+
+class ConfigSnapshot(object):
+
+    # the parsed contents of every config file read by a run, kept in one pickle so the next run doesn't parse the yaml again.
+    # an entry is used if the file's size and mtime are the same, or if they aren't but the contents hash is
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.changed = False
+        self.parsed = 0
+        self.reused = 0
+        if filename is not None:
+            self.read()
+
+    def read(self):
+        try:
+            with open(self.filename, 'rb') as fh:
+                version, entries = pickle.load(fh)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.warning("ignoring config snapshot %s: %s" % (self.filename, e))
+            return
+        if version == SNAPSHOT_VERSION:
+            self.entries = entries
+
+    def load(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(path)
+
+        if entry is not None:
+            if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+                self.reused += 1
+                return entry['config']
+            if entry['size'] == stat.st_size and entry['sha'] == hash_file(path):
+                with self.lock:
+                    entry['mtime'] = stat.st_mtime_ns
+                    self.changed = True
+                self.reused += 1
+                return entry['config']
+
+        with open(path) as fh:
+            config = yaml.load(fh, Loader=YamlLoader)
+        self.parsed += 1
+        with self.lock:
+            self.entries[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha': hash_file(path), 'config': config}
+            self.changed = True
+        return config
+
+    def write(self):
+        if self.filename is None or not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        tmp_filename = "%s.%d.tmp" % (self.filename, os.getpid())
+        with self.lock:
+            with open(tmp_filename, 'wb') as fh:
+                pickle.dump((SNAPSHOT_VERSION, self.entries), fh, protocol=pickle.HIGHEST_PROTOCOL)
+            self.changed = False
+        os.replace(tmp_filename, self.filename)
+        logging.debug("wrote config snapshot %s, %d files parsed, %d reused" % (self.filename, self.parsed, self.reused))
+
+# without a snapshot every file is parsed, as before
+snapshot = ConfigSnapshot()
+
+def use_snapshot(cache_dir):
+    global snapshot
+    snapshot = ConfigSnapshot(os.path.abspath(os.path.join(cache_dir, 'config', 'snapshot.pickle')))
+    return snapshot
+
+def load_yaml(path):
+    return snapshot.load(path)
+
+# callers may change what they are given, so they get their own copy
+def load_config(path):
+    return pickle.loads(pickle.dumps(load_yaml(path)))
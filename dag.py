@@ -0,0 +1,65 @@
+import hashlib
+import logging
+import os
+import time
+from cache import hash_file
+from scheduler import Task, PASS, CACHED
+
+# make like rebuilds for --flow. a step is skipped if it has already passed with the same inputs and its outputs are all still there.
+# files are compared by their contents, directories by the names, sizes and mtimes of everything in them, as hashing a whole
+# project would take longer than copying it
+
+# bump this to run every step again if the way stamps are made changes
+FLOW_VERSION = 1
+
+def tree_signature(path):
+    sha = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d != '.git')
+        for filename in sorted(files):
+            filepath = os.path.join(root, filename)
+            try:
+                stat = os.stat(filepath)
+            except FileNotFoundError:
+                # a broken link
+                continue
+            sha.update(("%s %d %d\n" % (os.path.relpath(filepath, path), stat.st_size, stat.st_mtime_ns)).encode())
+    return sha.hexdigest()
+
+def input_signature(path):
+    if os.path.isdir(path):
+        return tree_signature(path)
+    if os.path.exists(path):
+        return hash_file(path)
+    return None
+
+# a task that is skipped while its inputs, extra (any settings that change what it does) and outputs are the same as when it last passed.
+# inputs are only looked at when the task runs, so they can be made by the tasks it depends on
+class StampedTask(Task):
+
+    def __init__(self, project, name, func, cache, inputs, outputs, extra=None, resource=None, deps=()):
+        super().__init__(project, name, self.run_if_changed, resource, deps)
+        self.step = func
+        self.cache = cache
+        self.inputs = inputs
+        self.outputs = outputs
+        self.extra = extra
+
+    def stamp(self):
+        return self.cache.key('flow', FLOW_VERSION, str(self), {path: input_signature(path) for path in self.inputs}, self.outputs, self.extra)
+
+    def output_signatures(self):
+        return {path: input_signature(path) for path in self.outputs}
+
+    def run_if_changed(self):
+        key = self.stamp()
+        entry = self.cache.get('flow', key)
+        # outputs that have gone or been changed by hand are made again
+        if entry is not None and entry['outputs'] == self.output_signatures():
+            logging.info("%s is up to date" % self)
+            return CACHED
+
+        status = self.step() or PASS
+        if status == PASS:
+            self.cache.put('flow', key, {'task': str(self), 'outputs': self.output_signatures(), 'time': time.time()})
+        return status
@@ -1 +0,0 @@
-RBA::Application.instance.main_window.current_view.save_image("./pics/multi_macro.png",2000,2000)
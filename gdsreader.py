@@ -0,0 +1,321 @@
+import gzip
+import logging
+import math
+import os
+import struct
+import sys
+import threading
+from array import array
+
+# streaming GDSII reader, scans the records once to find the cell hierarchy, layers and extents without building any polygons.
+# record types, see http://boolean.klaasholwerda.nl/interface/bnf/gdsformat.html
+UNITS       = 0x03
+ENDLIB      = 0x04
+BGNSTR      = 0x05
+STRNAME     = 0x06
+ENDSTR      = 0x07
+BOUNDARY    = 0x08
+PATH        = 0x09
+SREF        = 0x0A
+AREF        = 0x0B
+TEXT        = 0x0C
+LAYER       = 0x0D
+DATATYPE    = 0x0E
+WIDTH       = 0x0F
+XY          = 0x10
+ENDEL       = 0x11
+SNAME       = 0x12
+COLROW      = 0x13
+NODE        = 0x15
+TEXTTYPE    = 0x16
+STRANS      = 0x1A
+MAG         = 0x1B
+ANGLE       = 0x1C
+NODETYPE    = 0x2A
+BOX         = 0x2D
+BOXTYPE     = 0x2E
+
+ELEMENTS = (BOUNDARY, PATH, SREF, AREF, TEXT, NODE, BOX)
+TYPES = (DATATYPE, TEXTTYPE, NODETYPE, BOXTYPE)
+
+def real8(data):
+    # GDSII 8 byte real: sign bit, 7 bit excess 64 base 16 exponent, 56 bit mantissa
+    value = int.from_bytes(data[:8], 'big')
+    sign = -1 if value & 0x8000000000000000 else 1
+    exponent = (value >> 56) & 0x7f
+    mantissa = value & 0x00ffffffffffffff
+    return sign * mantissa / (1 << 56) * 16.0 ** (exponent - 64)
+
+def merge_box(box, xmin, ymin, xmax, ymax):
+    if box is None:
+        return [xmin, ymin, xmax, ymax]
+    if xmin < box[0]: box[0] = xmin
+    if ymin < box[1]: box[1] = ymin
+    if xmax > box[2]: box[2] = xmax
+    if ymax > box[3]: box[3] = ymax
+    return box
+
+# merge a block of big endian x, y coordinate pairs into the box
+def merge_points(box, data):
+    points = array('i')
+    points.frombytes(data)
+    if sys.byteorder == 'little':
+        points.byteswap()
+    xs = points[0::2]
+    ys = points[1::2]
+    return merge_box(box, min(xs), min(ys), max(xs), max(ys))
+
+class GdsCell(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.layers = set()     # (layer, datatype) used directly in this cell
+        self.box = None         # extent of the cell's own shapes in database units
+        # references are merged by child and transform, only the spread of the origins is needed for the extent
+        self.references = {}    # (child, reflection, angle, magnification) -> box of the reference origins
+
+class GdsSummary(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.unit = 1.0         # user units per database unit
+        self.cells = {}
+        self._boxes = {}
+        self._layers = {}
+
+    @property
+    def top_cells(self):
+        referenced = set()
+        for cell in self.cells.values():
+            for child, reflection, angle, magnification in cell.references:
+                referenced.add(child)
+        return [name for name in self.cells if name not in referenced]
+
+    # the biggest of the unreferenced cells
+    @property
+    def top_cell(self):
+        top_cells = self.top_cells
+        if len(top_cells) > 1:
+            logging.warning("%s has %d top level cells: %s" % (self.filename, len(top_cells), top_cells))
+            top_cells.sort(key=self._area, reverse=True)
+        return top_cells[0]
+
+    def _area(self, name):
+        box = self._box(name)
+        if box is None:
+            return 0
+        return (box[2] - box[0]) * (box[3] - box[1])
+
+    def _box(self, name):
+        if name in self._boxes:
+            return self._boxes[name]
+
+        cell = self.cells.get(name)
+        if cell is None:
+            logging.warning("%s references missing cell %s" % (self.filename, name))
+            self._boxes[name] = None
+            return None
+
+        box = None if cell.box is None else list(cell.box)
+        for (child, reflection, angle, magnification), origins in cell.references.items():
+            child_box = self._box(child)
+            if child_box is None:
+                continue
+            # transform the corners of the child's box, then spread over all the origins
+            xs = []
+            ys = []
+            cos = math.cos(math.radians(angle)) * magnification
+            sin = math.sin(math.radians(angle)) * magnification
+            for x, y in ((child_box[0], child_box[1]), (child_box[0], child_box[3]), (child_box[2], child_box[1]), (child_box[2], child_box[3])):
+                if reflection:
+                    y = -y
+                xs.append(x * cos - y * sin)
+                ys.append(x * sin + y * cos)
+            box = merge_box(box, origins[0] + min(xs), origins[1] + min(ys), origins[2] + max(xs), origins[3] + max(ys))
+
+        self._boxes[name] = box
+        return box
+
+    def _layer_datatypes(self, name):
+        if name in self._layers:
+            return self._layers[name]
+
+        layers = set()
+        cell = self.cells.get(name)
+        if cell is not None:
+            layers.update(cell.layers)
+            for child in set(reference[0] for reference in cell.references):
+                layers.update(self._layer_datatypes(child))
+
+        self._layers[name] = layers
+        return layers
+
+    # same as gdspy's Cell.get_bounding_box: [[xmin, ymin], [xmax, ymax]] in user units, including referenced cells
+    def get_bounding_box(self, cell=None):
+        box = self._box(cell or self.top_cell)
+        if box is None:
+            return None
+        return [[box[0] * self.unit, box[1] * self.unit], [box[2] * self.unit, box[3] * self.unit]]
+
+    # same as gdspy's Cell.get_layers: set of layer numbers used, including referenced cells
+    def get_layers(self, cell=None):
+        return set(layer for layer, datatype in self._layer_datatypes(cell or self.top_cell))
+
+    def get_layer_datatypes(self, cell=None):
+        return set(self._layer_datatypes(cell or self.top_cell))
+
+def open_gds(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb', buffering=1 << 20)
+
+# if extents is False, coordinates aren't decoded which makes it faster when only the hierarchy and layers are needed
+def read_gds_summary(filename, extents=True):
+    summary = GdsSummary(filename)
+    cell = None
+    element = None
+    layer = datatype = 0
+    width = 0
+    sname = None
+    reflection = False
+    angle = 0.0
+    magnification = 1.0
+    colrow = (1, 1)
+    xy = None
+    points = bytearray()
+
+    unpack_header = struct.Struct('>HB').unpack_from
+    unpack_short = struct.Struct('>h').unpack_from
+    unpack_from = struct.unpack_from
+    buf = b''
+    pos = 0
+    length = 4
+    record = None
+    # read the file in large chunks and walk the records in the buffer, this keeps the per record overhead low
+    with open_gds(filename) as fh:
+        while True:
+            chunk = fh.read(1 << 22)
+            if not chunk:
+                break
+            buf = buf[pos:] + chunk
+            pos = 0
+            buf_end = len(buf)
+            while pos + 4 <= buf_end:
+                length, record = unpack_header(buf, pos)
+                start = pos + 4
+                end = pos + length
+                if length < 4 or end > buf_end:
+                    break
+                pos = end
+                # fast path for the common polygon layout: BOUNDARY LAYER DATATYPE XY ENDEL, handled in one step
+                if record == BOUNDARY and extents and pos + 16 <= buf_end and buf[pos + 2] == LAYER and buf[pos + 8] == DATATYPE and buf[pos + 14] == XY:
+                    xy_end = pos + 12 + unpack_header(buf, pos + 12)[0]
+                    if xy_end + 4 <= buf_end and buf[xy_end + 2] == ENDEL:
+                        cell.layers.add((unpack_short(buf, pos + 4)[0], unpack_short(buf, pos + 10)[0]))
+                        points += buf[pos + 16:xy_end]
+                        if len(points) > 1 << 22:
+                            cell.box = merge_points(cell.box, points)
+                            points = bytearray()
+                        pos = xy_end + 4
+                        continue
+
+                if record == XY:
+                    if not extents:
+                        pass
+                    # polygons are the bulk of the file, so their coordinates are collected and decoded in blocks
+                    elif element == BOUNDARY or element == BOX:
+                        points += buf[start:end]
+                        if len(points) > 1 << 22:
+                            cell.box = merge_points(cell.box, points)
+                            points = bytearray()
+                    else:
+                        xy = unpack_from('>%di' % ((end - start) // 4), buf, start)
+                elif record == ENDEL:
+                    if element in (BOUNDARY, PATH, BOX, TEXT, NODE):
+                        cell.layers.add((layer, datatype))
+                        # labels don't count towards the extent
+                        if xy is not None and element not in (TEXT, NODE):
+                            xs = xy[0::2]
+                            ys = xy[1::2]
+                            half_width = abs(width) / 2 if element == PATH else 0
+                            cell.box = merge_box(cell.box, min(xs) - half_width, min(ys) - half_width, max(xs) + half_width, max(ys) + half_width)
+                    elif element in (SREF, AREF):
+                        key = (sname, reflection, angle, magnification)
+                        origins = cell.references.get(key)
+                        if xy is None:
+                            cell.references[key] = origins or [0, 0, 0, 0]
+                        else:
+                            ox, oy = xy[0], xy[1]
+                            corners = [(ox, oy)]
+                            if element == AREF:
+                                cols, rows = colrow
+                                col_x = (xy[2] - ox) / cols
+                                col_y = (xy[3] - oy) / cols
+                                row_x = (xy[4] - ox) / rows
+                                row_y = (xy[5] - oy) / rows
+                                for i, j in ((cols - 1, 0), (0, rows - 1), (cols - 1, rows - 1)):
+                                    corners.append((ox + i * col_x + j * row_x, oy + i * col_y + j * row_y))
+                            for x, y in corners:
+                                origins = merge_box(origins, x, y, x, y)
+                            cell.references[key] = origins
+                    element = None
+                elif record == LAYER:
+                    layer = unpack_short(buf, start)[0]
+                elif record in TYPES:
+                    datatype = unpack_short(buf, start)[0]
+                elif record in ELEMENTS:
+                    element = record
+                    layer = datatype = width = 0
+                    sname = None
+                    reflection = False
+                    angle = 0.0
+                    magnification = 1.0
+                    colrow = (1, 1)
+                    xy = None
+                elif record == WIDTH:
+                    width = unpack_from('>i', buf, start)[0]
+                elif record == SNAME:
+                    sname = buf[start:end].rstrip(b'\0').decode('ascii')
+                elif record == STRANS:
+                    reflection = bool(buf[start] & 0x80)
+                elif record == MAG:
+                    magnification = real8(buf[start:end])
+                elif record == ANGLE:
+                    angle = real8(buf[start:end])
+                elif record == COLROW:
+                    colrow = unpack_from('>hh', buf, start)
+                elif record == BGNSTR:
+                    cell = None
+                elif record == STRNAME:
+                    name = buf[start:end].rstrip(b'\0').decode('ascii')
+                    cell = GdsCell(name)
+                    summary.cells[name] = cell
+                elif record == ENDSTR:
+                    if len(points):
+                        cell.box = merge_points(cell.box, points)
+                        points = bytearray()
+                    cell = None
+                elif record == UNITS:
+                    summary.unit = real8(buf[start:end])
+                elif record == ENDLIB:
+                    break
+            # stop at the end of the library, or on padding or a broken record
+            if length < 4 or record == ENDLIB:
+                break
+
+    return summary
+
+summaries = {}
+summaries_lock = threading.Lock()
+
+# summaries already read, by path, size and mtime, so a GDS is only read again if it has changed
+def get_gds_summary(filename):
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+    with summaries_lock:
+        if key in summaries:
+            return summaries[key]
+    summary = read_gds_summary(filename)
+    with summaries_lock:
+        summaries[key] = summary
+    return summary
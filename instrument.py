@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from tabulate import tabulate
+
+# records wall time, cpu and peak memory of each stage (a check, proof, clone etc) and of every command run with utils.run_cmd
+
+stages = []
+commands = []
+records_lock = threading.Lock()
+# the stage running in the current thread, commands are added to it
+stage_context = threading.local()
+
+# a server runs many commands, each one gets its own report
+def reset():
+    with records_lock:
+        stages.clear()
+        commands.clear()
+
+def new_usage():
+    return {'wall': 0.0, 'user': 0.0, 'sys': 0.0, 'max_rss_mb': 0.0}
+
+@contextmanager
+def stage(project, name):
+    record = {'project': project, 'stage': name, 'start': time.time(), 'status': 'pass', 'commands': 0, 'cpu_self': 0.0}
+    record.update(new_usage())
+    parent = getattr(stage_context, 'stage', None)
+    stage_context.stage = record
+    start = time.monotonic()
+    start_cpu = time.thread_time()
+    try:
+        yield record
+    except BaseException:
+        record['status'] = 'FAIL'
+        raise
+    finally:
+        # cpu used by python in this thread, the commands' cpu is added by record_command
+        record['cpu_self'] = time.thread_time() - start_cpu
+        record['wall'] = time.monotonic() - start
+        stage_context.stage = parent
+        if parent is not None:
+            add_usage(parent, record)
+            parent['commands'] += record['commands']
+        with records_lock:
+            stages.append(record)
+
+def add_usage(record, usage):
+    record['user'] += usage['user']
+    record['sys'] += usage['sys']
+    record['max_rss_mb'] = max(record['max_rss_mb'], usage['max_rss_mb'])
+
+# rusage is from os.wait4, so it is only the command's own use (and its children's)
+def record_command(cmd, wall, rusage, returncode):
+    current = getattr(stage_context, 'stage', None)
+    record = {
+        'project':      current['project'] if current else None,
+        'stage':        current['stage'] if current else None,
+        'command':      cmd if isinstance(cmd, str) else ' '.join(str(arg) for arg in cmd),
+        'wall':         wall,
+        'user':         rusage.ru_utime,
+        'sys':          rusage.ru_stime,
+        # linux reports kB
+        'max_rss_mb':   rusage.ru_maxrss / 1024,
+        'returncode':   returncode,
+    }
+    if current is not None:
+        add_usage(current, record)
+        current['commands'] += 1
+    with records_lock:
+        commands.append(record)
+
+def summary_table():
+    table = []
+    for record in sorted(stages, key=lambda record: record['wall'], reverse=True):
+        table.append([record['project'], record['stage'], record['status'], record['wall'], record['user'] + record['cpu_self'], record['sys'], record['max_rss_mb'], record['commands']])
+    return tabulate(table, headers=['project', 'stage', 'status', 'wall s', 'user s', 'sys s', 'max rss MB', 'commands'], floatfmt='.1f')
+
+def write_report(filename):
+    with records_lock:
+        report = {'time': time.time(), 'cpus': os.cpu_count(), 'stages': stages, 'commands': commands}
+        with open(filename, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    if len(stages):
+        logging.info("stage timings:\n%s" % summary_table())
+    logging.info("wrote run report to %s" % filename)
@@ -0,0 +1,34 @@
+import json
+import re
+
+# counts the errors in netgen's json output, the same way as OpenLane's count_lvs.py
+def count_lvs_errors(netgen_json):
+    with open(netgen_json) as fh:
+        circuits = json.load(fh)
+
+    errors = {'nets': 0, 'devices': 0, 'pins': 0, 'properties': 0, 'net_count': 0, 'device_count': 0}
+    for index, circuit in enumerate(circuits):
+        # cells that don't match are flattened and compared again, so most errors only count for the top cell, which is last
+        if index == len(circuits) - 1:
+            if 'devices' in circuit:
+                # number of each device type in each netlist
+                counts = [dict((device, count) for device, count in devices) for devices in circuit['devices']]
+                for device in set(counts[0]) | set(counts[1]):
+                    errors['device_count'] += abs(counts[0].get(device, 0) - counts[1].get(device, 0))
+            if 'nets' in circuit:
+                errors['net_count'] += abs(circuit['nets'][0] - circuit['nets'][1])
+            errors['nets'] += len(circuit.get('badnets', []))
+            errors['devices'] += len(circuit.get('badelements', []))
+            if 'pins' in circuit:
+                for left, right in zip(*circuit['pins']):
+                    # ignore case and global net markers, and pins that are missing because they aren't connected
+                    left = re.sub('!$', '', left.lower())
+                    right = re.sub('!$', '', right.lower())
+                    if left != right and '(no pin)' not in (left, right):
+                        errors['pins'] += 1
+
+        # property errors count for every cell
+        errors['properties'] += len(circuit.get('properties', []))
+
+    errors['total'] = sum(errors.values())
+    return errors
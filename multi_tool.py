@@ -1,12 +1,25 @@
 #!/usr/bin/env python3
-import logging, sys, argparse
-from collect import Collection
-
-if __name__ == '__main__':
+import logging, sys, argparse, atexit, copy, os
+from collect import Collection, REQUIRED_KEYS_LOCAL
+from utils import parse_config
+from runlogs import analyse_runs
+from cache import ResultCache
+from sync import LINK_MODES
+from instrument import write_report
+from configcache import use_snapshot
+from server import serve, send_command
+import instrument
+
+def get_parser():
     parser = argparse.ArgumentParser(description="test a project repo")
     parser.add_argument('--force-delete', help='instead of aborting on existing files, delete them', action='store_const', const=True)
     subparsers = parser.add_subparsers(help='help for subcommand', dest="command")
 
+    runs_parser = subparsers.add_parser('runs', help="compare the OpenLane runs of the user_project_wrapper: router violations against time, step runtimes and peak memory")
+    runs_parser.add_argument('--openlane-dir', help="the user_project_wrapper's OpenLane directory, its runs/ and tests/ are scanned. defaults to the one in caravel")
+    runs_parser.add_argument('--output-dir', help="where to put runs.json and the plots", default='runs_report')
+    runs_parser.add_argument('--format', help="what to write as well as runs.json", nargs='*', choices=['png', 'html'], default=['png', 'html'])
+
     parser.add_argument('--config', help="the config file listing all project directories", default='projects.yaml')
     parser.add_argument('--local-config', help="the local environment config file", default='local.yaml')
     parser.add_argument('--project', help="just run for a single project, supply project ID", type=int)
@@ -14,6 +27,8 @@ if __name__ == '__main__':
     parser.add_argument('--test-module', help="run the module's test", action='store_const', const=True)
     parser.add_argument('--prove-wrapper', help="check the wrapper proof", action='store_const', const=True)
     parser.add_argument('--test-caravel', help="check the caravel test", action='store_const', const=True)
+    parser.add_argument('--caravel-jobs', help="with --jobs, run at most this many caravel tests at once, the default is --jobs", type=int)
+    parser.add_argument('--caravel-timeout', help="fail a caravel test that takes longer than this many seconds", type=int)
     parser.add_argument('--test-gds', help="check the gds", action='store_const', const=True)
     parser.add_argument('--test-lvs', help="check the gds against powered verilog", action='store_const', const=True)
     parser.add_argument('--test-tristate-z', help="check outputs are z when not active", action='store_const', const=True)
@@ -22,7 +37,23 @@ if __name__ == '__main__':
     parser.add_argument('--test-git', help="check gitsha on disk matches the config", action='store_const', const=True)
     parser.add_argument('--test-all', help="run all the checks for each project", action='store_const', const=True)
     parser.add_argument('--test-from', help="run all the checks for all projects with id equal or more than the given id", type=int)
-    parser.add_argument('--prove-tristate', help="build and run the tristate proof", action='store_const', const=True)
+    parser.add_argument('--prove-tristate', help="build and run a tristate proof for each macro, in parallel", action='store_const', const=True)
+    parser.add_argument('--prove-tristate-combined', help="build and run the tristate proof of the whole user_project_wrapper", action='store_const', const=True)
+    parser.add_argument('--jobs', help="run the checks in parallel with this many workers, a failing check doesn't stop the others", type=int)
+    policy = parser.add_mutually_exclusive_group()
+    policy.add_argument('--keep-going', help="run every check even after one has failed, the default with --jobs", action='store_const', const=True)
+    policy.add_argument('--fail-fast', help="don't start any more checks once one has failed, the default without --jobs or --flow", action='store_const', const=True)
+    parser.add_argument('--results', help="write the result of each check to this file, .xml for JUnit or .json")
+    parser.add_argument('--log-dir', help="where to put the per project logs when using --jobs", default='logs')
+    parser.add_argument('--no-cache', help="don't skip checks that have already passed with the same commit, inputs and tools", action='store_const', const=True)
+    parser.add_argument('--cache-dir', help="where to keep the results of passing checks", default='.multi_tool_cache')
+    parser.add_argument('--cache-evict', help="remove cache entries that haven't been used for this many days", type=float)
+    parser.add_argument('--check-config', help="check every project's info.yaml and report all the errors", action='store_const', const=True)
+    parser.add_argument('--flow', help="run the other actions given as a graph of tasks: each project's steps start as soon as what they need is done, and copies whose inputs haven't changed are skipped", action='store_const', const=True)
+    parser.add_argument('--pipeline', help="run these stages in order with one collection. each stage is a comma separated list of options without the leading dashes, eg test-gds,test-ports copy-gds,sync generate-doc", nargs='+')
+    parser.add_argument('--serve', help="keep running and take commands on this unix socket, see --client")
+    parser.add_argument('--client', help="send the rest of the options to the multi_tool.py --serve listening on this socket")
+    parser.add_argument('--report', help="write the time, cpu and memory used by each check and command to this json file, and print a summary")
 
     parser.add_argument('--openram', help="use OpenRAM - instantiate the bridge, wrapper and do the wiring", action='store_const', const=True)
     parser.add_argument('--clone-shared-repos', help="clone shared repos defined in projects.yaml", action='store_const', const=True)
@@ -31,33 +62,35 @@ if __name__ == '__main__':
     parser.add_argument('--gate-level', help="create the caravel includes file with gate level includes", action='store_const', const=True)
     parser.add_argument('--copy-project', help="copy project's RTL and tests to correct locations in caravel_user_project", action='store_const', const=True)
     parser.add_argument('--copy-gds', help="copy the projects GDS and LEF files", action='store_const', const=True)
+    parser.add_argument('--sync', help="with --copy-gds and --copy-project, only copy files that have changed and update existing directories in place", action='store_const', const=True)
+    parser.add_argument('--link', help="how to copy files: reflink shares the data where the filesystem supports it, hardlink means changes in caravel also change the project", choices=LINK_MODES, default='reflink')
     parser.add_argument('--generate-doc', help="generate a index.md file with information about each project", action='store_const', const=True)
     parser.add_argument('--dump-hash', help="print current commit hash of each project along with author and title", action='store_const', const=True)
     parser.add_argument('--fill', help="for testing, repeat the given projects this number of times", type=int)
     parser.add_argument('--annotate-image', help="annotate the multi_macro.png image generated by klayout", action='store_const', const=True)
+    parser.add_argument('--allocate', help="place the macros with this policy instead of using the positions in projects.yaml. packed uses the real macro sizes", choices=['legacy', 'packed'])
     parser.add_argument('--dump-macro-position', help="use the macro.cfg + gds to create a list of positions and sizes", action='store_const', const=True)
     parser.add_argument('--count-cells', help="cells per design and total", action='store_const', const=True)
+    parser.add_argument('--cell-report', help="with --count-cells, write the per cell type counts to this file, .csv or .json")
 
-    args = parser.parse_args()
-
-    # setup log
-    log_format = logging.Formatter('%(asctime)s - %(module)-15s - %(levelname)-8s - %(message)s')
-    # configure the client logging
-    log = logging.getLogger('')
-    # has to be set to debug as is the root logger
-    log.setLevel(logging.INFO)
+    return parser
 
-    # create console handler and set level to info
-    ch = logging.StreamHandler(sys.stdout)
-    # create formatter for console
-    ch.setFormatter(log_format)
-    log.addHandler(ch)
+# options that decide which projects are in the collection, so can't change between the stages of a pipeline
+COLLECTION_OPTIONS = ['config', 'local_config', 'project', 'test_from', 'openram', 'clone_repos', 'clone_shared_repos', 'fill', 'check_config']
 
-    collection = Collection(args)
+def run_actions(collection, args):
+    # the same actions, run as a graph of tasks
+    if args.flow:
+        collection.run_flow()
+        return
 
     # run any tests specified by arguments
     collection.run_tests()
 
+    # positions are needed by the openlane config, image annotation and macro position dump
+    if args.allocate:
+        collection.allocate_macros()
+
     # create all the OpenLane config for the user collection wrapper
     if args.create_openlane_config:
         collection.create_openlane_config()
@@ -65,6 +98,9 @@ if __name__ == '__main__':
     if args.prove_tristate:
         collection.prove_all_tristate()
 
+    if args.prove_tristate_combined:
+        collection.prove_combined_tristate()
+
     # copy gds to correct place
     if args.copy_gds:
         collection.copy_all_gds()
@@ -87,3 +123,100 @@ if __name__ == '__main__':
     if args.count_cells:
         collection.count_cells()
 
+# test-gds,jobs=4 -> ['--test-gds', '--jobs=4']
+def stage_options(stage):
+    return ['--' + option for option in stage.split(',') if option]
+
+# the collection is built once and its projects keep what they have loaded (configs, ports, GDS summaries, git shas) for the later stages.
+# options given outside --pipeline apply to every stage
+def run_pipeline(parser, args, collection):
+    for number, stage in enumerate(args.pipeline):
+        stage_args = parser.parse_args(stage_options(stage), namespace=copy.copy(args))
+        for option in COLLECTION_OPTIONS:
+            if getattr(stage_args, option) != getattr(args, option):
+                logging.error("--%s can't be set in a pipeline stage, give it before --pipeline" % option.replace('_', '-'))
+                exit(1)
+        logging.info("pipeline stage %d/%d: %s" % (number + 1, len(args.pipeline), stage))
+        collection.set_args(stage_args)
+        with instrument.stage('pipeline', stage):
+            run_actions(collection, stage_args)
+
+# doesn't need the projects, only where caravel is
+def analyse_openlane_runs(args):
+    openlane_dir = args.openlane_dir
+    if openlane_dir is None:
+        local_config = parse_config(args.local_config, REQUIRED_KEYS_LOCAL)
+        openlane_dir = os.path.join(local_config['caravel']['root'], 'openlane', 'user_project_wrapper')
+    store_file = None if args.no_cache else os.path.join(args.cache_dir, 'runs', 'logs.json')
+    analyse_runs(openlane_dir, args.output_dir, store_file, args.format, args.jobs)
+
+def run(parser, args):
+    if args.command == 'runs':
+        analyse_openlane_runs(args)
+        return
+
+    collection = Collection(args)
+    if args.pipeline:
+        run_pipeline(parser, args, collection)
+    else:
+        run_actions(collection, args)
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+
+    if args.client:
+        # everything but --client is run by the server
+        argv = sys.argv[1:]
+        index = argv.index('--client') if '--client' in argv else None
+        if index is not None:
+            del argv[index:index + 2]
+        else:
+            argv = [arg for arg in argv if not arg.startswith('--client=')]
+        exit(send_command(args.client, argv))
+
+    # setup log
+    log_format = logging.Formatter('%(asctime)s - %(module)-15s - %(levelname)-8s - %(message)s')
+    # configure the client logging
+    log = logging.getLogger('')
+    # has to be set to debug as is the root logger
+    log.setLevel(logging.INFO)
+
+    # create console handler and set level to info
+    ch = logging.StreamHandler(sys.stdout)
+    # create formatter for console
+    ch.setFormatter(log_format)
+    log.addHandler(ch)
+
+    # written on exit so that failed runs are reported too
+    if args.report:
+        atexit.register(write_report, args.report)
+
+    if args.cache_evict is not None:
+        ResultCache(args.cache_dir).evict(args.cache_evict)
+
+    # parsed config files are kept in the cache directory and only parsed again when they change
+    snapshot = None
+    if not args.no_cache:
+        snapshot = use_snapshot(args.cache_dir)
+        atexit.register(snapshot.write)
+
+    if args.serve:
+        def run_command(argv):
+            command_args = parser.parse_args(argv)
+            if command_args.serve or command_args.client:
+                logging.error("--serve and --client can't be sent to a server")
+                exit(1)
+            # each command gets a fresh collection, so that changed files are read again. the file level caches are kept
+            instrument.reset()
+            try:
+                run(parser, command_args)
+            finally:
+                if command_args.report:
+                    write_report(command_args.report)
+                if snapshot is not None:
+                    snapshot.write()
+        serve(args.serve, run_command, log_format)
+        exit(0)
+
+    run(parser, args)
@@ -0,0 +1,233 @@
+import glob
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from verilog import parse_declaration, split_top_level, PortParseError
+
+# gate level netlist scanning, counts standard cell instances and indexes the connections without building the netlist
+
+# cells are put in the first category that matches the name after the library prefix, anything else is logic
+CELL_CATEGORIES = [
+    ('fill',    re.compile(r'fill')),
+    ('decap',   re.compile(r'decap')),
+    ('tap',     re.compile(r'tap')),
+    ('diode',   re.compile(r'diode')),
+    ('buffer',  re.compile(r'(buf|clkbuf|clkdlybuf|dlygate|dlymetal)')),
+]
+
+# fill and decap are left out of the total, same as the old grep pipeline
+UNCOUNTED_CATEGORIES = ['fill', 'decap']
+
+lef_macro_re = re.compile(r'^\s*MACRO\s+(\S+)(.*?)^\s*END\s+\1\b', re.M | re.S)
+lef_size_re = re.compile(r'^\s*SIZE\s+([\d.]+)\s+BY\s+([\d.]+)', re.M)
+
+# statements of a gate level netlist, the netlist is split on ; so these match a single statement
+netlist_comment_re = re.compile(r'//[^\n]*|/\*.*?\*/|\(\*.*?\*\)', re.S)
+endmodule_re = re.compile(r'^\s*endmodule\b')
+module_re = re.compile(r'^\s*module\s+(\S+?)\s*\((.*)\)\s*$', re.S)
+declaration_re = re.compile(r'^\s*(input|output|inout)\b')
+gate_re = re.compile(r'^\s*([A-Za-z_][\w$]*)\s+(\\\S+|[A-Za-z_][\w$]*)\s*\((.*)\)\s*$', re.S)
+pin_re = re.compile(r'\.(\w+)\s*\(\s*(.*?)\s*\)', re.S)
+
+# output pins of the sky130 standard cells, every other pin is an input or power
+OUTPUT_PINS = {'X', 'Y', 'Z', 'Q', 'Q_N', 'HI', 'LO', 'GCLK', 'COUT', 'SUM', 'CON'}
+
+# the index is stored in the result cache, bump this if its contents change
+NETLIST_INDEX_VERSION = 1
+
+BLOCK_SIZE = 1 << 22
+
+cell_sizes = {}
+cell_sizes_lock = threading.Lock()
+
+# the end of the last complete statement in text that isn't in the middle of a comment or attribute
+def statements_end(text):
+    end = text.rfind(';') + 1
+    while end > 0:
+        cut = end
+        for opening, closing in (('/*', '*/'), ('(*', '*)')):
+            start = text.rfind(opening, 0, cut)
+            if start >= 0 and text.find(closing, start + 2, end) < 0:
+                cut = start
+        comment = text.find('//', text.rfind('\n', 0, cut) + 1, cut)
+        if comment >= 0:
+            cut = comment
+        if cut == end:
+            break
+        end = text.rfind(';', 0, cut) + 1
+    return end
+
+# the statements of a netlist with the comments and attributes removed, read in blocks so big netlists don't need to fit in memory
+def netlist_statements(path):
+    tail = ''
+    with open(path) as fh:
+        for block in iter(lambda: fh.read(BLOCK_SIZE), ''):
+            text = tail + block
+            end = statements_end(text)
+            tail = text[end:]
+            for statement in netlist_comment_re.sub(' ', text[:end]).split(';'):
+                yield statement
+    for statement in netlist_comment_re.sub(' ', tail).split(';'):
+        yield statement
+
+def port_bits(name, width):
+    if width == 1:
+        return [name]
+    return ["%s[%d]" % (name, bit) for bit in range(width)]
+
+# one pass through the netlist, for each module: its ports, the number of instances of each cell type, the number of nets,
+# and for each port bit, the cells driving it and the number of cell inputs it goes to
+def index_netlist(path):
+    modules = {}
+    module = None
+    for statement in netlist_statements(path):
+        statement = endmodule_re.sub('', statement)
+        if not statement.strip():
+            continue
+
+        m = gate_re.match(statement)
+        if m is not None and m.group(1) not in ('module', 'wire', 'assign', 'reg', 'supply0', 'supply1', 'parameter', 'localparam'):
+            if module is None:
+                continue
+            cell_type = m.group(1)
+            cells = module['cells']
+            cells[cell_type] = cells.get(cell_type, 0) + 1
+            for pin, net in pin_re.findall(m.group(3)):
+                if ' ' in net:
+                    net = net.replace(' ', '')
+                module['nets'].add(net)
+                # only the port bits are kept
+                if net.split('[', 1)[0] not in module['ports']:
+                    continue
+                if pin in OUTPUT_PINS:
+                    module['drivers'].setdefault(net, []).append([cell_type, m.group(2), pin])
+                else:
+                    module['loads'][net] = module['loads'].get(net, 0) + 1
+            continue
+
+        m = module_re.match(statement)
+        if m is not None:
+            module = {'ports': {}, 'cells': {}, 'nets': set(), 'drivers': {}, 'loads': {}}
+            modules[m.group(1)] = module
+            header = [item.strip() for item in split_top_level(m.group(2)) if item.strip()]
+            # ANSI headers have the directions in them, otherwise they come from the declarations
+            if len(header) and declaration_re.match(header[0]):
+                direction = width = None
+                for item in header:
+                    item_direction, item_width, names = parse_declaration(item, {})
+                    if item_direction is not None:
+                        direction, width = item_direction, item_width
+                    for name in names:
+                        module['ports'][name] = {'direction': direction, 'width': width}
+            else:
+                for name in header:
+                    module['ports'][name] = None
+            continue
+
+        if module is not None and declaration_re.match(statement):
+            try:
+                direction, width, names = parse_declaration(statement, {})
+            except PortParseError as e:
+                logging.warning("%s: %s" % (path, e))
+                continue
+            for name in names:
+                module['ports'][name] = {'direction': direction, 'width': width}
+
+    index = {'modules': {}, 'cells': Counter()}
+    for name, module in modules.items():
+        index['modules'][name] = {
+            'ports':    {port: info for port, info in module['ports'].items() if info is not None},
+            'cells':    module['cells'],
+            'nets':     len(module['nets']),
+            'drivers':  module['drivers'],
+            'loads':    module['loads'],
+        }
+        index['cells'].update(module['cells'])
+    index['cells'] = dict(index['cells'])
+    return index
+
+class NetlistIndex(object):
+
+    def __init__(self, index):
+        self.index = index
+
+    def has_module(self, module_name):
+        return module_name in self.index['modules']
+
+    # {cell type: number of instances} of all the standard cells in the netlist
+    def standard_cells(self):
+        return {cell: count for cell, count in self.index['cells'].items() if cell.startswith('sky130_')}
+
+    def ports(self, module_name):
+        return self.index['modules'][module_name]['ports']
+
+    def port_drivers(self, module_name, bit):
+        return self.index['modules'][module_name]['drivers'].get(bit, [])
+
+    # port bits driven by a tristate buffer that are also read by other cells, they would see the other macros' values
+    # when this design isn't active. this is the same as the old yosys selection on ebufn Z outputs
+    def tristate_loopbacks(self, module_name):
+        module = self.index['modules'][module_name]
+        errors = []
+        for bit, drivers in sorted(module['drivers'].items()):
+            if not any(cell_type.startswith('sky130_fd_sc_hd__ebufn_') and pin == 'Z' for cell_type, instance, pin in drivers):
+                continue
+            if module['loads'].get(bit, 0):
+                errors.append("%s is driven by a tristate buffer and read by %d cell inputs" % (bit, module['loads'][bit]))
+        return errors
+
+def cell_category(cell_type):
+    name = cell_type.split('__', 1)[-1]
+    for category, pattern in CELL_CATEGORIES:
+        if pattern.match(name):
+            return category
+    return 'logic'
+
+# {cell type: (width, height)} in um from the library's LEF files
+def get_cell_sizes(pdk_path, library):
+    # the efabless cells are kept with the foundry ones
+    lef_dir = os.path.join(pdk_path, 'libs.ref', library.replace('sky130_ef_', 'sky130_fd_'), 'lef')
+    with cell_sizes_lock:
+        if lef_dir in cell_sizes:
+            return cell_sizes[lef_dir]
+
+        sizes = {}
+        lef_files = glob.glob(os.path.join(lef_dir, '*.lef'))
+        if len(lef_files) == 0:
+            logging.warning("no LEF files in %s, can't estimate area of %s cells" % (lef_dir, library))
+        for lef_file in lef_files:
+            with open(lef_file) as fh:
+                for m in lef_macro_re.finditer(fh.read()):
+                    size = lef_size_re.search(m.group(2))
+                    if size is not None:
+                        sizes[m.group(1)] = (float(size.group(1)), float(size.group(2)))
+
+        cell_sizes[lef_dir] = sizes
+        return sizes
+
+# total, per category counts and the estimated area of the cells
+def summarise_cells(cells, pdk_path=None):
+    categories = Counter()
+    area = 0.0
+    missing = set()
+    for cell_type, count in cells.items():
+        categories[cell_category(cell_type)] += count
+        if pdk_path is None:
+            continue
+        size = get_cell_sizes(pdk_path, cell_type.split('__', 1)[0]).get(cell_type)
+        if size is None:
+            missing.add(cell_type)
+        else:
+            area += size[0] * size[1] * count
+
+    if len(missing):
+        logging.warning("no size for cells %s" % sorted(missing))
+
+    return {
+        'total':        sum(count for category, count in categories.items() if category not in UNCOUNTED_CATEGORIES),
+        'categories':   dict(categories),
+        'area':         round(area, 3) if pdk_path is not None else None,
+        'cells':        dict(sorted(cells.items())),
+    }
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from cache import hash_file, get_tool_version
+from utils import run_cmd
+
+# renders parts of a GDS to png with klayout. each image is a box in um and a size in px, the images are shared out between
+# several klayout processes that each load the GDS once. an image is only rendered again if the GDS, layer properties or box change
+
+RENDER_SCRIPT = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'render_tiles.py')
+
+class Renderer(object):
+
+    def __init__(self, gds_file, layer_props, output_dir, jobs=None):
+        self.gds_file = gds_file
+        self.layer_props = layer_props
+        self.output_dir = output_dir
+        self.jobs = jobs or os.cpu_count()
+        self.images = []
+        self.manifest_file = os.path.join(output_dir, 'render.json')
+        # what each image was rendered from
+        self.sources = [hash_file(gds_file), hash_file(layer_props), hash_file(RENDER_SCRIPT), get_tool_version('klayout')]
+
+    def add(self, filename, box, width, height):
+        self.images.append({'file': os.path.join(self.output_dir, filename), 'box': [round(v, 3) for v in box], 'width': int(width), 'height': int(height)})
+        return self.images[-1]['file']
+
+    def key(self, image):
+        return hashlib.sha256(json.dumps([self.sources, image['box'], image['width'], image['height']]).encode()).hexdigest()
+
+    # only the images that have changed are rendered
+    def run(self):
+        try:
+            with open(self.manifest_file) as fh:
+                manifest = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            manifest = {}
+
+        todo = [image for image in self.images if manifest.get(image['file']) != self.key(image) or not os.path.exists(image['file'])]
+        logging.info("rendering %d of %d images of %s" % (len(todo), len(self.images), self.gds_file))
+        if len(todo):
+            for image in todo:
+                os.makedirs(os.path.dirname(image['file']), exist_ok=True)
+            # interleaved, so each process gets some of the big and the small images
+            batches = [todo[i::self.jobs] for i in range(min(self.jobs, len(todo)))]
+            with ThreadPoolExecutor(max_workers=len(batches)) as pool:
+                for future in [pool.submit(self.render, number, batch) for number, batch in enumerate(batches)]:
+                    future.result()
+
+        for image in self.images:
+            manifest[image['file']] = self.key(image)
+        with open(self.manifest_file, 'w') as fh:
+            json.dump(manifest, fh, indent=1, sort_keys=True)
+
+    def render(self, number, batch):
+        jobs_file = os.path.join(self.output_dir, 'render_jobs_%d.json' % number)
+        with open(jobs_file, 'w') as fh:
+            json.dump(batch, fh)
+        cmd = ['klayout', '-z', '-nc', '-rx', '-r', RENDER_SCRIPT, '-rd', 'gds=%s' % self.gds_file, '-rd', 'lyp=%s' % self.layer_props, '-rd', 'jobs=%s' % jobs_file]
+        if os.path.exists('klayoutrc'):
+            cmd += ['-c', 'klayoutrc']
+        try:
+            run_cmd(cmd, check=True)
+        except subprocess.CalledProcessError as e:
+            logging.error(e)
+            exit(1)
+        finally:
+            os.remove(jobs_file)
+
+# a pyramid of tiles like a map: level 0 is the whole box in one tile, each level doubles the resolution up to max_px_per_um.
+# tiles are named <level>/<x>_<y>.png with 0, 0 at the top left
+def add_tile_pyramid(renderer, box, tile_size, max_px_per_um, directory='tiles'):
+    x1, y1, x2, y2 = box
+    size_um = max(x2 - x1, y2 - y1)
+    levels = []
+    level = 0
+    while True:
+        px_per_um = tile_size * 2 ** level / size_um
+        tile_um = tile_size / px_per_um
+        columns = math.ceil((x2 - x1) / tile_um)
+        rows = math.ceil((y2 - y1) / tile_um)
+        for column in range(columns):
+            for row in range(rows):
+                # gds has y going up, images have it going down
+                tile_x = x1 + column * tile_um
+                tile_y = y2 - (row + 1) * tile_um
+                renderer.add(os.path.join(directory, str(level), '%d_%d.png' % (column, row)), (tile_x, tile_y, tile_x + tile_um, tile_y + tile_um), tile_size, tile_size)
+        levels.append({'level': level, 'px_per_um': px_per_um, 'columns': columns, 'rows': rows})
+        if px_per_um >= max_px_per_um:
+            break
+        level += 1
+
+    # describes the pyramid for a viewer
+    manifest = {'box': box, 'tile_size': tile_size, 'levels': levels}
+    os.makedirs(os.path.join(renderer.output_dir, directory), exist_ok=True)
+    with open(os.path.join(renderer.output_dir, directory, 'tiles.json'), 'w') as fh:
+        json.dump(manifest, fh, indent=1)
+    return manifest
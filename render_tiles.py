@@ -0,0 +1,15 @@
+# run by klayout, see render.py. renders each job in the jobs file from one load of the GDS:
+#   klayout -z -nc -rx -r render_tiles.py -rd gds=<gds> -rd lyp=<layer properties> -rd jobs=<jobs.json>
+import json
+import pya
+
+view = pya.LayoutView()
+view.load_layout(gds, True)
+view.load_layer_props(lyp)
+view.max_hier()
+
+with open(jobs) as fh:
+    for job in json.load(fh):
+        x1, y1, x2, y2 = job['box']
+        # no oversampling, line width 0 and resolution 0 keep the defaults
+        view.save_image_with_options(job['file'], job['width'], job['height'], 0, 0, 0, pya.DBox(x1, y1, x2, y2), False)
@@ -0,0 +1,302 @@
+import heapq
+import html
+import json
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+# analytics of the OpenLane runs of the user_project_wrapper. every log of every run is scanned once, in big blocks with
+# precompiled patterns, for the router's violations and the time and memory the tools report. what is found is kept per log file in a
+# store that is only scanned again when the log's size or mtime change, so trials can be compared while they are still running
+
+# bump this if what is kept for each log changes
+STORE_VERSION = 2
+
+BLOCK_SIZE = 16 << 20
+
+# one pattern each, as a pattern that starts with plain text is searched for much quicker than an alternation. they all start mid line
+# TritonRoute:  [INFO DRT-0199]   Number of violations = 1234.
+violations_re = re.compile(rb'umber of violations = (\d+)')
+# OpenROAD:     [INFO DRT-0267] cpu time = 00:01:02, elapsed time = 00:00:20, memory = 1234.56 (MB), peak = 2345.67 (MB)
+# only the records with the cpu time, as TritonRoute's progress lines within an iteration have an elapsed time too
+elapsed_re = re.compile(rb'cpu time = [\d:]+, elapsed time = (\d+):(\d+):(\d+)(?:, memory = [\d.]+ ?\(MB\), peak = ([\d.]+))?')
+# yosys:        End of script. Logfile hash: 1234abcd, CPU: user 1.23s system 0.04s, MEM: 95.63 MB peak
+yosys_re = re.compile(rb'CPU: user ([\d.]+)s system ([\d.]+)s, MEM: ([\d.]+) MB peak')
+
+# 19-tritonRoute.log -> 19, tritonRoute
+step_re = re.compile(r'^(\d+)[-_](.*)$')
+
+# where the trials are kept, relative to the user_project_wrapper's OpenLane directory
+RUN_DIRS = ['runs', 'tests']
+
+class LogScan(object):
+
+    def __init__(self):
+        self.iteration_times = []   # seconds from the first iteration
+        self.violations = []
+        self.elapsed = 0
+        self.runtime = None         # seconds, None if the tool didn't say
+        self.peak_mb = None
+
+    def feed(self, text):
+        # the matches of all the patterns, in the order they are in the log
+        matches = heapq.merge(violations_re.finditer(text), elapsed_re.finditer(text), yosys_re.finditer(text), key=lambda m: m.start())
+        for m in matches:
+            if m.re is violations_re:
+                # each routing iteration reports its violations, then the time it took
+                self.violations.append(int(m.group(1)))
+                self.iteration_times.append(self.elapsed)
+            elif m.re is elapsed_re:
+                seconds = int(m.group(1)) * 3600 + int(m.group(2)) * 60 + int(m.group(3))
+                self.runtime = (self.runtime or 0) + seconds
+                if len(self.violations):
+                    self.elapsed += seconds
+                if m.group(4) is not None:
+                    self.peak_mb = max(self.peak_mb or 0, float(m.group(4)))
+            else:
+                self.runtime = (self.runtime or 0) + float(m.group(1)) + float(m.group(2))
+                self.peak_mb = max(self.peak_mb or 0, float(m.group(3)))
+
+    def result(self):
+        return {'iteration_times': self.iteration_times, 'violations': self.violations, 'runtime': self.runtime, 'peak_mb': self.peak_mb}
+
+def scan_log(path):
+    scan = LogScan()
+    rest = b''
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(BLOCK_SIZE), b''):
+            text = rest + block
+            # only whole lines are matched, the partial last line goes with the next block
+            end = text.rfind(b'\n') + 1
+            scan.feed(text[:end])
+            rest = text[end:]
+    scan.feed(rest)
+    return scan.result()
+
+# every log below the run directories: {path: (run, log name)}. a run is a directory in runs/ or tests/
+def find_logs(openlane_dir):
+    logs = {}
+    for run_dir in RUN_DIRS:
+        try:
+            runs = sorted(os.scandir(os.path.join(openlane_dir, run_dir)), key=lambda entry: entry.name)
+        except FileNotFoundError:
+            continue
+        for run in runs:
+            if not run.is_dir():
+                continue
+            for root, dirs, files in os.walk(run.path):
+                for filename in files:
+                    if filename.endswith('.log'):
+                        logs[os.path.join(root, filename)] = (os.path.join(run_dir, run.name), filename[:-len('.log')])
+    return logs
+
+class RunLogStore(object):
+
+    # what was found in each log, by path. an entry is used while the log's size and mtime are the same
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.entries = {}
+        if filename is not None:
+            try:
+                with open(filename) as fh:
+                    store = json.load(fh)
+                if store.get('version') == STORE_VERSION:
+                    self.entries = store['logs']
+            except FileNotFoundError:
+                pass
+            except ValueError as e:
+                logging.warning("ignoring run log store %s: %s" % (filename, e))
+
+    def scan(self, logs, jobs=None):
+        todo = []
+        for path in logs:
+            stat = os.stat(path)
+            entry = self.entries.get(path)
+            if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+                todo.append((path, stat))
+        logging.info("scanning %d of %d logs" % (len(todo), len(logs)))
+
+        # biggest first, as most of the time is the few biggest logs
+        todo.sort(key=lambda item: -item[1].st_size)
+        with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+            for (path, stat), result in zip(todo, pool.map(scan_log, [path for path, stat in todo])):
+                result.update({'size': stat.st_size, 'mtime': stat.st_mtime_ns})
+                self.entries[path] = result
+
+        # logs that have gone
+        for path in list(self.entries):
+            if path not in logs:
+                del self.entries[path]
+
+    def write(self):
+        if self.filename is None:
+            return
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        tmp_filename = "%s.%d.tmp" % (self.filename, os.getpid())
+        with open(tmp_filename, 'w') as fh:
+            json.dump({'version': STORE_VERSION, 'logs': self.entries}, fh, separators=(',', ':'))
+        os.replace(tmp_filename, self.filename)
+
+def step_order(step):
+    m = step_re.match(step)
+    return (int(m.group(1)), m.group(2)) if m is not None else (float('inf'), step)
+
+# the table of steps as columns, one row per log: run, step, runtime (s), peak memory (MB), last number of violations.
+# a step's runtime is what its tool reported, or if it didn't report one the time from the previous log of the run being written to this one
+def build_step_table(logs, store):
+    columns = {'run': [], 'step': [], 'runtime': [], 'peak_mb': [], 'violations': []}
+    runs = {}
+    for path, (run, step) in logs.items():
+        runs.setdefault(run, []).append((step, path))
+
+    for run in sorted(runs):
+        previous_mtime = None
+        for step, path in sorted(runs[run], key=lambda item: step_order(item[0])):
+            entry = store.entries[path]
+            runtime = entry['runtime']
+            if runtime is None and previous_mtime is not None:
+                runtime = max(0, (entry['mtime'] - previous_mtime) / 1e9)
+            previous_mtime = entry['mtime']
+            columns['run'].append(run)
+            columns['step'].append(step)
+            columns['runtime'].append(runtime)
+            columns['peak_mb'].append(entry['peak_mb'])
+            columns['violations'].append(entry['violations'][-1] if len(entry['violations']) else None)
+    return columns
+
+# router violations against time for each run, from the logs that have them
+def build_violation_series(logs, store):
+    series = {}
+    for path, (run, step) in sorted(logs.items(), key=lambda item: (item[1][0], step_order(item[1][1]))):
+        entry = store.entries[path]
+        if len(entry['violations']):
+            series.setdefault(run, {'times': [], 'violations': []})
+            # later routing steps carry on from the end of the earlier ones
+            offset = series[run]['times'][-1] if len(series[run]['times']) else 0
+            series[run]['times'] += [offset + time for time in entry['iteration_times']]
+            series[run]['violations'] += entry['violations']
+    return series
+
+def run_summaries(steps):
+    summaries = {}
+    for run, runtime, peak_mb, violations in zip(steps['run'], steps['runtime'], steps['peak_mb'], steps['violations']):
+        summary = summaries.setdefault(run, {'runtime': 0, 'peak_mb': None, 'violations': None})
+        summary['runtime'] += runtime or 0
+        if peak_mb is not None:
+            summary['peak_mb'] = max(summary['peak_mb'] or 0, peak_mb)
+        if violations is not None:
+            summary['violations'] = violations
+    return summaries
+
+# headless, so it works in CI and over ssh
+def plot_runs(output_dir, series, steps, summaries):
+    try:
+        import matplotlib
+    except ImportError:
+        logging.error("matplotlib isn't installed, so there are no plots. pip install matplotlib to make them")
+        return []
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    images = []
+    if len(series):
+        fig, ax = plt.subplots(figsize=(12, 8))
+        for run, data in series.items():
+            ax.plot(data['times'], data['violations'], label=run, linewidth=3.0)
+        ax.set_xlabel('time (s)')
+        ax.set_ylabel('violations')
+        ax.set_yscale('log')
+        ax.legend()
+        ax.grid()
+        images.append(save_plot(fig, output_dir, 'violations.png'))
+
+    runs = sorted(summaries)
+    if len(runs):
+        # each run's runtime stacked by step, the longest steps are the ones worth tuning
+        fig, ax = plt.subplots(figsize=(12, max(4, len(runs) * 0.5)))
+        left = [0] * len(runs)
+        step_names = sorted(set(steps['step']), key=step_order)
+        for step in step_names:
+            widths = [0] * len(runs)
+            for run, step_name, runtime in zip(steps['run'], steps['step'], steps['runtime']):
+                if step_name == step and runtime:
+                    widths[runs.index(run)] += runtime
+            if any(widths):
+                ax.barh(runs, widths, left=left, label=step)
+                left = [a + b for a, b in zip(left, widths)]
+        ax.set_xlabel('runtime (s)')
+        if len(step_names) <= 30:
+            ax.legend(fontsize='small', ncol=2)
+        images.append(save_plot(fig, output_dir, 'runtime.png'))
+
+        fig, ax = plt.subplots(figsize=(12, max(4, len(runs) * 0.5)))
+        ax.barh(runs, [summaries[run]['peak_mb'] or 0 for run in runs])
+        ax.set_xlabel('peak memory (MB)')
+        images.append(save_plot(fig, output_dir, 'peak_memory.png'))
+
+    plt.close('all')
+    return images
+
+def save_plot(fig, output_dir, filename):
+    fig.tight_layout()
+    path = os.path.join(output_dir, filename)
+    fig.savefig(path)
+    logging.info("wrote %s" % path)
+    return filename
+
+def format_value(value, fmt):
+    return '' if value is None else fmt % value
+
+def write_html(output_dir, images, steps, summaries):
+    rows = []
+    for run in sorted(summaries):
+        summary = summaries[run]
+        rows.append("<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>" % (html.escape(run),
+            format_value(summary['runtime'], '%.0f'), format_value(summary['peak_mb'], '%.0f'), format_value(summary['violations'], '%d')))
+    step_rows = []
+    for run, step, runtime, peak_mb, violations in zip(steps['run'], steps['step'], steps['runtime'], steps['peak_mb'], steps['violations']):
+        step_rows.append("<tr><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>" % (html.escape(run), html.escape(step),
+            format_value(runtime, '%.0f'), format_value(peak_mb, '%.0f'), format_value(violations, '%d')))
+
+    path = os.path.join(output_dir, 'runs.html')
+    with open(path, 'w') as fh:
+        fh.write("<html><head><title>OpenLane runs</title></head><body>\n")
+        fh.write("<h1>OpenLane runs</h1>\n")
+        fh.write("<table border=1><tr><th>run</th><th>runtime (s)</th><th>peak memory (MB)</th><th>violations</th></tr>\n%s\n</table>\n" % '\n'.join(rows))
+        for image in images:
+            fh.write('<p><img src="%s"></p>\n' % image)
+        fh.write("<h2>Steps</h2>\n")
+        fh.write("<table border=1><tr><th>run</th><th>step</th><th>runtime (s)</th><th>peak memory (MB)</th><th>violations</th></tr>\n%s\n</table>\n" % '\n'.join(step_rows))
+        fh.write("</body></html>\n")
+    logging.info("wrote %s" % path)
+
+def analyse_runs(openlane_dir, output_dir, store_file=None, formats=('png', 'html'), jobs=None):
+    logs = find_logs(openlane_dir)
+    if not len(logs):
+        logging.error("no OpenLane logs found in %s" % ', '.join(os.path.join(openlane_dir, run_dir) for run_dir in RUN_DIRS))
+        exit(1)
+
+    store = RunLogStore(store_file)
+    store.scan(logs, jobs)
+    store.write()
+
+    steps = build_step_table(logs, store)
+    series = build_violation_series(logs, store)
+    summaries = run_summaries(steps)
+
+    os.makedirs(output_dir, exist_ok=True)
+    # the columns, for anything else that wants to compare the runs
+    with open(os.path.join(output_dir, 'runs.json'), 'w') as fh:
+        json.dump({'steps': steps, 'violations': series}, fh, indent=1)
+
+    images = []
+    if 'png' in formats or 'html' in formats:
+        images = plot_runs(output_dir, series, steps, summaries)
+    if 'html' in formats:
+        write_html(output_dir, images, steps, summaries)
+
+    for run in sorted(summaries):
+        summary = summaries[run]
+        logging.info("%-30s runtime %8ss peak %8s MB violations %s" % (run, format_value(summary['runtime'], '%.0f'),
+            format_value(summary['peak_mb'], '%.0f'), format_value(summary['violations'], '%d')))
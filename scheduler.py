@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from tabulate import tabulate
+from utils import task_context
+
+PASS = 'pass'
+FAIL = 'FAIL'
+CACHED = 'cached'
+WAIVED = 'waived'
+# not run because an earlier check failed with --fail-fast, or a task it depends on failed
+SKIPPED = 'skipped'
+
+class TaskLogHandler(logging.Handler):
+    # writes log records to the log file of the task running in the current thread, if there is one,
+    # and keeps the task's last message and last error to say why it failed or was waived
+    def emit(self, record):
+        if getattr(task_context, 'task', None) is not None:
+            task_context.task.message = record.getMessage()
+            if record.levelno >= logging.ERROR:
+                task_context.task.error = record.getMessage()
+        log_fh = getattr(task_context, 'log_fh', None)
+        if log_fh is not None:
+            log_fh.write(self.format(record) + "\n")
+            log_fh.flush()
+
+class Task(object):
+
+    # project is None for the steps that work on the whole collection.
+    # a task is only started once the tasks it depends on have passed, so they must be earlier in the list given to the scheduler
+    def __init__(self, project, name, func, resource=None, deps=()):
+        self.project = project
+        self.name = name
+        self.func = func
+        self.resource = resource # tasks that use the same resource (eg a shared directory) are not run at the same time
+        self.deps = list(deps)
+        self.status = None
+        self.log_file = None
+        self.duration = 0.0
+        self.message = None
+        self.error = None
+
+    @property
+    def owner(self):
+        return self.project.instance_name if self.project is not None else 'collection'
+
+    def __str__(self):
+        return "%s %s" % (self.owner, self.name)
+
+    # the outcome of the task, for the results file
+    def result(self):
+        return {'project': self.owner, 'check': self.name, 'status': self.status, 'duration': round(self.duration, 3),
+                'log_file': self.log_file, 'message': self.error if self.status == FAIL else self.message}
+
+class Scheduler(object):
+
+    # with a log_dir each task's output goes to its own log file, without one it goes to the console.
+    # with fail_fast no more tasks are started once one has failed. limits is how many tasks can use each resource at once, default 1
+    def __init__(self, jobs, log_dir, fail_fast=False, limits=None):
+        self.jobs = jobs
+        self.log_dir = log_dir
+        self.fail_fast = fail_fast
+        self.limits = limits or {}
+        self.failed = threading.Event()
+        self.handler = TaskLogHandler()
+        self.handler.setFormatter(logging.Formatter('%(asctime)s - %(module)-15s - %(levelname)-8s - %(message)s'))
+
+    def run_task(self, task):
+        if self.fail_fast and self.failed.is_set():
+            task.status = SKIPPED
+            return task
+
+        if self.log_dir is not None:
+            project_log_dir = os.path.join(self.log_dir, task.owner)
+            os.makedirs(project_log_dir, exist_ok=True)
+            task.log_file = os.path.join(project_log_dir, "%s.log" % task.name)
+
+        log_fh = open(task.log_file, 'w') if task.log_file is not None else None
+        task_context.log_fh = log_fh
+        task_context.task = task
+        start = time.monotonic()
+        try:
+            logging.info("starting %s" % task)
+            task.status = task.func() or PASS
+        # checks call exit(1) on failure, so catch that as well as any unexpected errors
+        except SystemExit:
+            task.status = FAIL
+        except Exception as e:
+            logging.exception(e)
+            task.status = FAIL
+        finally:
+            task.duration = time.monotonic() - start
+            task_context.log_fh = None
+            task_context.task = None
+            if log_fh is not None:
+                log_fh.close()
+
+        if task.status == FAIL:
+            self.failed.set()
+            if task.log_file is not None:
+                logging.error("%s failed, see %s" % (task, task.log_file))
+            else:
+                logging.error("%s failed" % task)
+        else:
+            logging.info("%s %s" % (task, {CACHED: 'cached', WAIVED: 'waived'}.get(task.status, 'passed')))
+        return task
+
+    def run(self, tasks):
+        # how many tasks are running that use each resource
+        in_use = {task.resource: 0 for task in tasks if task.resource is not None}
+
+        if self.log_dir is not None:
+            logging.info("running %d tasks with %d jobs, logs in %s" % (len(tasks), self.jobs, self.log_dir))
+        logging.getLogger('').addHandler(self.handler)
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                # every task whose dependencies are done is started, then the scheduler waits for any one of them to finish
+                pending = list(tasks)
+                running = {}
+                while len(pending) or len(running):
+                    waiting = []
+                    for task in pending:
+                        if self.fail_fast and self.failed.is_set():
+                            task.status = SKIPPED
+                        elif any(dep.status in (FAIL, SKIPPED) for dep in task.deps):
+                            task.status = SKIPPED
+                            logging.warning("%s skipped, it needs %s" % (task, ', '.join(str(dep) for dep in task.deps if dep.status in (FAIL, SKIPPED))))
+                        elif not all(dep.status is not None and dep not in pending for dep in task.deps):
+                            waiting.append(task)
+                        elif task.resource is not None and in_use[task.resource] >= (self.limits.get(task.resource) or 1):
+                            # not started until a task using the resource finishes, so it doesn't take up a job while it waits
+                            waiting.append(task)
+                        else:
+                            if task.resource is not None:
+                                in_use[task.resource] += 1
+                            running[pool.submit(self.run_task, task)] = task
+                    pending = waiting
+                    if not len(running):
+                        break
+                    done, not_done = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        task = running.pop(future)
+                        if task.resource is not None:
+                            in_use[task.resource] -= 1
+                        future.result()
+        finally:
+            logging.getLogger('').removeHandler(self.handler)
+
+        for task in tasks:
+            if task.status is None:
+                task.status = SKIPPED
+        return tasks
+
+def results_matrix(tasks):
+    # one row per project, one column per check
+    projects = []
+    checks = []
+    results = {}
+    for task in tasks:
+        if task.project not in projects:
+            projects.append(task.project)
+        if task.name not in checks:
+            checks.append(task.name)
+        results[(task.project, task.name)] = task.status
+
+    table = []
+    for project in projects:
+        table.append([str(project) if project is not None else 'collection'] + [results.get((project, check), '') for check in checks])
+
+    return tabulate(table, headers=["project"] + checks)
+
+# a summary of the tasks: passed, failed, etc
+def results_summary(tasks):
+    counts = {}
+    for task in tasks:
+        counts[task.status] = counts.get(task.status, 0) + 1
+    return ', '.join("%d %s" % (count, status) for status, count in counts.items())
+
+# the result of each task, .xml is JUnit for CI, anything else is json
+def write_results(tasks, filename):
+    logging.info("writing results to %s" % filename)
+    if filename.endswith('.xml'):
+        suites = ET.Element('testsuites')
+        projects = {}
+        for task in tasks:
+            projects.setdefault(task.owner, []).append(task)
+        for project, project_tasks in projects.items():
+            suite = ET.SubElement(suites, 'testsuite', name=project, tests=str(len(project_tasks)),
+                failures=str(sum(task.status == FAIL for task in project_tasks)),
+                skipped=str(sum(task.status in (WAIVED, SKIPPED) for task in project_tasks)),
+                time="%.3f" % sum(task.duration for task in project_tasks))
+            for task in project_tasks:
+                result = task.result()
+                case = ET.SubElement(suite, 'testcase', classname=project, name=task.name, time="%.3f" % task.duration)
+                if task.status == FAIL:
+                    ET.SubElement(case, 'failure', message=result['message'] or 'failed')
+                elif task.status == WAIVED:
+                    ET.SubElement(case, 'skipped', message=result['message'] or WAIVED)
+                elif task.status == SKIPPED:
+                    ET.SubElement(case, 'skipped', message="not run after an earlier failure")
+                if task.log_file is not None:
+                    ET.SubElement(case, 'system-out').text = "log: %s" % task.log_file
+        ET.ElementTree(suites).write(filename, encoding='utf-8', xml_declaration=True)
+    else:
+        with open(filename, 'w') as fh:
+            json.dump([task.result() for task in tasks], fh, indent=1)
@@ -0,0 +1,93 @@
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import traceback
+import utils
+
+# a multi_tool.py that stays running and takes command lines over a unix socket, so the python start up, imports and the
+# file level caches (config snapshot, file hashes, tool versions, GDS summaries) are kept between commands.
+# a request is one line of json, the client's directory and arguments. the reply is the log of running them, then a last line with the exit status
+
+EXIT_PREFIX = 'EXIT '
+
+class CommandHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            cwd, argv = request['cwd'], request['argv']
+        except (ValueError, KeyError, TypeError) as e:
+            self.wfile.write(("bad request: %s\n%s1\n" % (e, EXIT_PREFIX)).encode())
+            return
+
+        out = io.TextIOWrapper(self.wfile, write_through=True)
+        handler = logging.StreamHandler(out)
+        handler.setFormatter(self.server.log_format)
+        log = logging.getLogger('')
+        log.addHandler(handler)
+        logging.info("running %s in %s" % (' '.join(argv), cwd))
+        # the output of make, sby, iverilog etc goes to the client as well, unless it's going to a task log
+        utils.command_output = self.wfile
+        status = 0
+        try:
+            # paths in the arguments are relative to the client's directory
+            os.chdir(cwd)
+            self.server.run_command(argv)
+        except SystemExit as e:
+            # most errors exit(1), that ends this command but not the server
+            status = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            logging.error(traceback.format_exc())
+            status = 1
+        finally:
+            utils.command_output = None
+            log.removeHandler(handler)
+        try:
+            out.write("%s%d\n" % (EXIT_PREFIX, status))
+            out.detach()
+        except OSError:
+            # the client went away
+            pass
+
+# commands are run one at a time, they share the logging setup and the module level state
+class CommandServer(socketserver.UnixStreamServer):
+
+    def __init__(self, path, run_command, log_format):
+        self.run_command = run_command
+        self.log_format = log_format
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, CommandHandler)
+
+def serve(path, run_command, log_format):
+    # commands change directory
+    path = os.path.abspath(path)
+    server = CommandServer(path, run_command, log_format)
+    logging.info("waiting for commands on %s" % path)
+    # stop cleanly when killed as well as on ctrl-c
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+# send the arguments to a server, print its log and return its exit status
+def send_command(path, argv):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall((json.dumps({'cwd': os.getcwd(), 'argv': argv}) + '\n').encode())
+        status = 1
+        for line in sock.makefile('r'):
+            if line.startswith(EXIT_PREFIX):
+                status = int(line[len(EXIT_PREFIX):])
+            else:
+                sys.stdout.write(line)
+    return status
@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+import re
+import threading
+import xml.etree.ElementTree as ET
+from cache import ResultCache, hash_file, get_tool_version
+from utils import run_cmd
+
+BUFFERTEST_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'buffertest')
+CELL_HEADER = os.path.join(BUFFERTEST_DIR, 'header.v')
+
+library_lock = threading.Lock()
+tristate_results = {}
+results_lock = threading.Lock()
+
+# the sky130 cell models preprocessed with the defines in header.v, built once and kept in the cache directory.
+# designs are compiled against it as a library (iverilog -l), so only the cells a design uses are elaborated
+def get_cell_library(pdk_root, cache_dir):
+    include_dir = os.path.join(pdk_root, 'sky130A')
+    with open(CELL_HEADER) as fh:
+        includes = re.findall(r'^`include "(.+)"', fh.read(), re.M)
+
+    sources = {'header.v': hash_file(CELL_HEADER)}
+    for include in includes:
+        sources[include] = hash_file(os.path.join(include_dir, include))
+    key = ResultCache(cache_dir).key('cell_library', sources, get_tool_version('iverilog'))
+    library = os.path.join(cache_dir, 'simlib', key + '.v')
+
+    with library_lock:
+        if not os.path.exists(library):
+            logging.info("building cell library %s" % library)
+            os.makedirs(os.path.dirname(library), exist_ok=True)
+            tmp_library = "%s.%d.tmp" % (library, os.getpid())
+            run_cmd(['iverilog', '-E', '-I', include_dir, '-o', tmp_library, CELL_HEADER], check=True)
+            os.replace(tmp_library, library)
+    return library
+
+# summary of a cocotb results.xml
+def read_results(results_file):
+    results = {'tests': 0, 'failures': []}
+    try:
+        root = ET.parse(results_file).getroot()
+    except (FileNotFoundError, ET.ParseError):
+        return results
+    for testcase in root.iter('testcase'):
+        results['tests'] += 1
+        for failure in testcase.iter('failure'):
+            results['failures'].append("%s: %s" % (testcase.get('name'), failure.get('message')))
+    return results
+
+def add_tristate_result(instance_name, result):
+    with results_lock:
+        tristate_results[instance_name] = result
+
+# all the projects' tristate z results in one file
+def write_tristate_report(filename):
+    with results_lock:
+        if len(tristate_results) == 0:
+            return
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'w') as fh:
+            json.dump(tristate_results, fh, indent=2, sort_keys=True)
+    logging.info("wrote tristate z results to %s" % filename)
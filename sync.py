@@ -0,0 +1,143 @@
+import fcntl
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cache import hash_file
+
+# ioctl to make dst share src's blocks on copy on write filesystems like btrfs and xfs, from linux/fs.h
+FICLONE = 0x40049409
+
+LINK_MODES = ['copy', 'reflink', 'hardlink']
+
+class SyncStats(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.copied = 0
+        self.skipped = 0
+        self.removed = 0
+        self.bytes_copied = 0
+        self.bytes_skipped = 0
+
+    def add(self, copied, size):
+        with self.lock:
+            if copied:
+                self.copied += 1
+                self.bytes_copied += size
+            else:
+                self.skipped += 1
+                self.bytes_skipped += size
+
+    def __str__(self):
+        return "copied %d files (%.1f MB), skipped %d unchanged files (%.1f MB), removed %d files" % (
+            self.copied, self.bytes_copied / 1e6, self.skipped, self.bytes_skipped / 1e6, self.removed)
+
+# size first, then mtime, and only hash the contents if the sizes match but the times don't
+def files_match(src, dst, src_stat):
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        return False
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if src_stat.st_mtime_ns == dst_stat.st_mtime_ns:
+        return True
+    if hash_file(src) != hash_file(dst):
+        return False
+    # same contents, so give dst the same time as src to skip the hash next time
+    os.utime(dst, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+    return True
+
+def reflink(src, dst):
+    with open(src, 'rb') as src_fh, open(dst, 'wb') as dst_fh:
+        fcntl.ioctl(dst_fh.fileno(), FICLONE, src_fh.fileno())
+
+class Syncer(object):
+
+    # if force is set, every file is copied, otherwise unchanged files are skipped.
+    # hardlinks mean that editing the file in caravel changes it in the project too, so they are only used if asked for
+    def __init__(self, jobs=None, link='reflink', force=False):
+        self.link = link
+        self.force = force
+        self.stats = SyncStats()
+        self.pool = ThreadPoolExecutor(max_workers=jobs or 8)
+        self.futures = []
+        self.reflink_failed = False
+
+    def copy(self, src, dst):
+        self.futures.append(self.pool.submit(self.sync_file, src, dst))
+
+    def sync_file(self, src, dst):
+        src_stat = os.stat(src)
+        if not self.force and files_match(src, dst, src_stat):
+            self.stats.add(False, src_stat.st_size)
+            return
+
+        logging.info("copying %s to %s" % (src, dst))
+        # copy to a temporary file then rename, so an interrupted copy never leaves a partial file that looks up to date
+        tmp_dst = "%s.%d.sync" % (dst, threading.get_ident())
+        if self.link == 'hardlink':
+            try:
+                os.link(src, tmp_dst)
+                os.replace(tmp_dst, dst)
+                self.stats.add(True, src_stat.st_size)
+                return
+            except OSError as e:
+                logging.debug("can't hardlink %s: %s" % (src, e))
+
+        copied = False
+        if self.link == 'reflink' and not self.reflink_failed:
+            try:
+                reflink(src, tmp_dst)
+                copied = True
+            except OSError as e:
+                # not supported by this filesystem, don't try again
+                logging.debug("can't reflink %s: %s" % (src, e))
+                self.reflink_failed = True
+        if not copied:
+            shutil.copyfile(src, tmp_dst)
+        # keep the mtime so the next sync can skip it
+        shutil.copystat(src, tmp_dst)
+        os.replace(tmp_dst, dst)
+        self.stats.add(True, src_stat.st_size)
+
+    # make dst the same as src, files in dst that aren't in src are removed.
+    # links in src are followed and what they point to is copied, like shutil.copytree
+    def sync_tree(self, src, dst):
+        logging.info("syncing %s to %s" % (src, dst))
+        for root, dirs, files in os.walk(src, followlinks=True):
+            dst_root = os.path.normpath(os.path.join(dst, os.path.relpath(root, src)))
+            os.makedirs(dst_root, exist_ok=True)
+            # remove anything that has gone from src, or has changed between a file and a directory,
+            # before the copies start writing their temporary files here
+            for name in os.listdir(dst_root):
+                path = os.path.join(dst_root, name)
+                is_dir = os.path.isdir(path) and not os.path.islink(path)
+                if (name in dirs and is_dir) or (name in files and not is_dir):
+                    continue
+                logging.info("removing %s" % path)
+                if is_dir:
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                with self.stats.lock:
+                    self.stats.removed += 1
+
+            for filename in files:
+                src_file = os.path.join(root, filename)
+                if not os.path.exists(src_file):
+                    logging.warning("skipping broken link %s" % src_file)
+                    continue
+                self.copy(src_file, os.path.join(dst_root, filename))
+
+    # wait for all the copies, a failed copy is raised here
+    def finish(self):
+        try:
+            for future in self.futures:
+                future.result()
+        finally:
+            self.pool.shutdown()
+            self.futures = []
+        logging.info(str(self.stats))
@@ -0,0 +1,36 @@
+import pytest
+from codegen.allocator import allocate_macros
+
+class Macro(object):
+
+    def __init__(self, id, size, title='macro', pos=None):
+        self.id = id
+        self.size = size
+        self.title = title
+        self.pos = pos
+        self.interfaces = ['wishbone']
+
+    def get_macro_size(self):
+        return self.size
+
+    def get_macro_pos(self):
+        return self.pos
+
+def test_packed_fits():
+    allocation = allocate_macros(2920, 3520, 100, 100, 10, [Macro(0, (300, 300)), Macro(1, (500, 400))], 'packed', False)
+    for (x, y), macro in zip(allocation.values(), [(300, 300), (500, 400)]):
+        assert 100 <= x and x + macro[0] <= 2820
+        assert 100 <= y and y + macro[1] <= 3420
+
+def test_too_wide():
+    with pytest.raises(SystemExit):
+        allocate_macros(2920, 3520, 100, 100, 10, [Macro(0, (3000, 100))], 'packed', False)
+
+def test_too_tall():
+    with pytest.raises(SystemExit):
+        allocate_macros(2920, 3520, 100, 100, 10, [Macro(0, (2000, 2000)), Macro(1, (2000, 2000))], 'packed', False)
+
+def test_shim_outside_the_area():
+    ram = Macro(9, (700, 500), 'ram', (2100, 100, 'N'))
+    with pytest.raises(SystemExit):
+        allocate_macros(2920, 3520, 100, 100, 10, [Macro(0, (300, 300), 'wb_openram_shim')], 'packed', True, [ram])
@@ -0,0 +1,33 @@
+import json
+from lvs import count_lvs_errors
+
+def write(tmp_path, circuits):
+    path = tmp_path / 'wrapped.json'
+    path.write_text(json.dumps(circuits))
+    return str(path)
+
+def test_clean(tmp_path):
+    circuits = [{
+        'name': ['wrapped', 'wrapped'],
+        'devices': [[['sky130_fd_sc_hd__inv_1', 4]], [['sky130_fd_sc_hd__inv_1', 4]]],
+        'nets': [10, 10],
+        'pins': [['vccd1', 'VSSD1!', 'io_out[0]'], ['VCCD1', 'vssd1', 'io_out[0]']],
+    }]
+    errors = count_lvs_errors(write(tmp_path, circuits))
+    assert errors['total'] == 0
+
+def test_errors(tmp_path):
+    circuits = [
+        # a subcell that didn't match is flattened, only its property errors count
+        {'name': ['cell', 'cell'], 'badnets': [1, 2], 'badelements': [1], 'properties': [1]},
+        {
+            'name': ['wrapped', 'wrapped'],
+            'devices': [[['sky130_fd_sc_hd__inv_1', 4], ['sky130_fd_sc_hd__buf_1', 1]], [['sky130_fd_sc_hd__inv_1', 2]]],
+            'nets': [10, 12],
+            'badnets': [1],
+            'badelements': [1, 2],
+            'pins': [['io_out[0]', 'io_out[1]', '(no pin)'], ['io_out[0]', 'io_in[1]', 'active']],
+        },
+    ]
+    errors = count_lvs_errors(write(tmp_path, circuits))
+    assert errors == {'nets': 1, 'devices': 2, 'pins': 1, 'properties': 1, 'net_count': 2, 'device_count': 3, 'total': 10}
@@ -0,0 +1,61 @@
+import netlist
+
+NETLIST = """// generated by yosys; not a statement
+module wrapped (vccd1, vssd1, io_in, io_out, active);
+  inout vccd1;
+  inout vssd1;
+  input [1:0] io_in;
+  output [1:0] io_out;
+  input active;
+  wire _0_;
+  (* keep; src = "wrapper.v:10" *)
+  sky130_fd_sc_hd__ebufn_2 _1_ (.A(io_in[0]), .TE_B(_0_), .Z(io_out[0]), .VPWR(vccd1), .VGND(vssd1));
+  sky130_fd_sc_hd__ebufn_2 _2_ (.A(io_in[1]), .TE_B(_0_), .Z(io_out[1]), .VPWR(vccd1), .VGND(vssd1));
+  /* io_out[1] is read back; which it mustn't be */
+  sky130_fd_sc_hd__inv_1 _3_ (.A(io_out[1]), .Y(_0_), .VPWR(vccd1), .VGND(vssd1));
+  sky130_fd_sc_hd__buf_1 _4_ (.A(active), .X(_0_), .VPWR(vccd1), .VGND(vssd1));
+  sky130_fd_sc_hd__decap_4 _5_ (.VPWR(vccd1), .VGND(vssd1));
+endmodule
+"""
+
+def index(tmp_path, text):
+    path = tmp_path / 'wrapped.v'
+    path.write_text(text)
+    return netlist.index_netlist(str(path))
+
+def test_index(tmp_path):
+    module = index(tmp_path, NETLIST)['modules']['wrapped']
+    assert module['ports'] == {
+        'vccd1': {'direction': 'inout', 'width': 1},
+        'vssd1': {'direction': 'inout', 'width': 1},
+        'io_in': {'direction': 'input', 'width': 2},
+        'io_out': {'direction': 'output', 'width': 2},
+        'active': {'direction': 'input', 'width': 1},
+    }
+    assert module['cells'] == {'sky130_fd_sc_hd__ebufn_2': 2, 'sky130_fd_sc_hd__inv_1': 1, 'sky130_fd_sc_hd__buf_1': 1, 'sky130_fd_sc_hd__decap_4': 1}
+    assert module['drivers']['io_out[0]'] == [['sky130_fd_sc_hd__ebufn_2', '_1_', 'Z']]
+    assert module['loads']['io_out[1]'] == 1
+
+def test_tristate_loopbacks(tmp_path):
+    index_ = netlist.NetlistIndex(index(tmp_path, NETLIST))
+    assert index_.tristate_loopbacks('wrapped') == ["io_out[1] is driven by a tristate buffer and read by 1 cell inputs"]
+
+def test_block_boundaries(tmp_path, monkeypatch):
+    expected = index(tmp_path, NETLIST)
+    # every block size splits statements, comments and attributes in different places
+    for block_size in range(5, 200, 7):
+        monkeypatch.setattr(netlist, 'BLOCK_SIZE', block_size)
+        assert index(tmp_path, NETLIST) == expected
+
+def test_statements_end():
+    assert netlist.statements_end("a; b") == 2
+    # a ; in an unfinished comment or attribute isn't the end of a statement
+    assert netlist.statements_end("a; /* b; c") == 2
+    assert netlist.statements_end("a; (* keep; ") == 2
+    assert netlist.statements_end("a; // b; c") == 2
+    assert netlist.statements_end("a; /* b; */ c;") == 14
+
+def test_summarise_cells():
+    summary = netlist.summarise_cells({'sky130_fd_sc_hd__buf_1': 2, 'sky130_fd_sc_hd__decap_4': 10, 'sky130_fd_sc_hd__nand2_1': 3})
+    assert summary['total'] == 5
+    assert summary['categories'] == {'buffer': 2, 'decap': 10, 'logic': 3}
@@ -0,0 +1,39 @@
+import runlogs
+
+ROUTE_LOG = b"""[INFO DRT-0195] Start 0th optimization iteration.
+    Completing 10% with 100 violations.
+    elapsed time = 00:00:30, memory = 1000.00 (MB).
+    Completing 20% with 200 violations.
+    elapsed time = 00:00:45, memory = 1100.00 (MB).
+[INFO DRT-0199]   Number of violations = 50.
+[INFO DRT-0267] cpu time = 00:03:00, elapsed time = 00:01:00, memory = 1200.00 (MB), peak = 1500.00 (MB)
+[INFO DRT-0195] Start 1st optimization iteration.
+    Completing 10% with 40 violations.
+    elapsed time = 00:00:30, memory = 1200.00 (MB).
+[INFO DRT-0199]   Number of violations = 5.
+[INFO DRT-0267] cpu time = 00:03:00, elapsed time = 00:01:00, memory = 1300.00 (MB), peak = 1600.00 (MB)
+"""
+
+def write_log(tmp_path, text):
+    path = tmp_path / '19-tritonRoute.log'
+    path.write_bytes(text)
+    return str(path)
+
+def test_progress_lines_are_not_counted(tmp_path):
+    result = runlogs.scan_log(write_log(tmp_path, ROUTE_LOG))
+    assert result['violations'] == [50, 5]
+    assert result['runtime'] == 120
+    assert result['iteration_times'] == [0, 60]
+    assert result['peak_mb'] == 1600.0
+
+def test_yosys(tmp_path):
+    result = runlogs.scan_log(write_log(tmp_path, b"End of script. Logfile hash: 1234abcd, CPU: user 1.25s system 0.25s, MEM: 95.5 MB peak\n"))
+    assert result['runtime'] == 1.5
+    assert result['peak_mb'] == 95.5
+
+def test_block_boundaries(tmp_path, monkeypatch):
+    path = write_log(tmp_path, ROUTE_LOG * 3)
+    expected = runlogs.scan_log(path)
+    # lines split across blocks are carried over to the next one
+    monkeypatch.setattr(runlogs, 'BLOCK_SIZE', 7)
+    assert runlogs.scan_log(path) == expected
@@ -0,0 +1,106 @@
+import pytest
+import verilog
+
+def test_preprocess_conditionals():
+    text = """`define WIDTH 8
+`ifdef USE_POWER_PINS
+powered
+`else
+unpowered
+`endif
+`ifndef MISSING
+`ifdef OTHER
+other
+`elsif WIDTH
+width `WIDTH
+`else
+neither
+`endif
+`endif
+"""
+    defines = {'USE_POWER_PINS': '1'}
+    lines = [line for line in verilog.preprocess(text, defines).split('\n') if line.strip()]
+    assert lines == ['powered', 'width 8']
+    assert defines['WIDTH'] == '8'
+
+def test_preprocess_keeps_line_numbers():
+    text = "a\n/* one\ntwo */\n`ifdef X\nb\n`endif\nc // comment\n"
+    assert [line.strip() for line in verilog.preprocess(text, {}).split('\n')] == ['a', '', '', '', '', '', 'c', '']
+
+@pytest.mark.parametrize('text', ["`endif\n", "`else\n", "`elsif X\n", "`ifdef X\nmodule a;\n"])
+def test_preprocess_unbalanced(text):
+    with pytest.raises(verilog.PortParseError):
+        verilog.preprocess(text, {})
+
+def test_ansi_ports():
+    text = """module wrapped #(parameter WIDTH = 4, parameter DEPTH = WIDTH * 2) (
+    input wire clk,
+    input wire [WIDTH-1:0] a, b,
+    output reg [DEPTH-1:0] y,
+    inout [37:0] io
+);
+endmodule
+"""
+    assert verilog.parse_module_ports(text, 'wrapped') == {
+        'clk': {'direction': 'input', 'width': 1},
+        'a': {'direction': 'input', 'width': 4},
+        'b': {'direction': 'input', 'width': 4},
+        'y': {'direction': 'output', 'width': 8},
+        'io': {'direction': 'inout', 'width': 38},
+    }
+
+def test_non_ansi_ports():
+    text = """module other (a); input a; endmodule
+module wrapped (clk, data, out);
+    parameter BITS = 16;
+    localparam TOP = BITS - 1;
+    input clk;
+    input [TOP:0] data;
+    output [3:0] out;
+endmodule
+"""
+    assert verilog.parse_module_ports(text, 'wrapped') == {
+        'clk': {'direction': 'input', 'width': 1},
+        'data': {'direction': 'input', 'width': 16},
+        'out': {'direction': 'output', 'width': 4},
+    }
+
+def test_missing_declaration():
+    with pytest.raises(verilog.PortParseError):
+        verilog.parse_module_ports("module wrapped (a, b); input a; endmodule\n", 'wrapped')
+
+def test_extract_ports_native_uses_earlier_defines(tmp_path):
+    defines = tmp_path / 'defines.v'
+    defines.write_text("`define BUS 12\n")
+    wrapper = tmp_path / 'wrapper.v'
+    wrapper.write_text("""module wrapped (
+`ifdef USE_POWER_PINS
+    inout vccd1,
+`endif
+    output [`BUS-1:0] io_out
+);
+endmodule
+""")
+    assert verilog.extract_ports_native([str(defines), str(wrapper)], 'wrapped') == {
+        'vccd1': {'direction': 'inout', 'width': 1},
+        'io_out': {'direction': 'output', 'width': 12},
+    }
+
+def test_module_declarations(tmp_path):
+    source = tmp_path / 'source.v'
+    source.write_text("""module first (input a);
+endmodule
+/*
+module commented (input a);
+endmodule
+*/
+`ifdef NOT_DEFINED
+module disabled (input a);
+endmodule
+`endif
+  macromodule second (input a);
+endmodule
+""")
+    # the scan is quick and finds them all, the preprocessed version only the real ones
+    assert verilog.scan_module_declarations(str(source)) == ['first', 'commented', 'disabled', 'second']
+    assert verilog.preprocessed_module_declarations([str(source)]) == {str(source): ['first', 'second']}
@@ -1,21 +1,36 @@
 import logging
 import os
 import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
 import yaml
 import git
+from urllib.parse import urlparse
+from instrument import record_command
+from configcache import load_config
 
 
+def missing_keys(config, required_keys, config_file):
+    if not isinstance(config, dict):
+        return ["%s is empty or isn't a mapping" % config_file]
+    return ["key %s not found in %s" % (key, config_file) for key in required_keys if key not in config]
+
+# all the missing keys are reported, not just the first
 def parse_config(config_file, required_keys):
-    with open(config_file, 'r') as stream:
-        try:
-            config = yaml.safe_load(stream)
-        except yaml.YAMLError as exc:
-            logging.error(exc)
-   
-    for key in required_keys:
-        if key not in config:
-            logging.error("key %s not found in %s" % (key, config_file))
-            exit(1)
+    try:
+        config = load_config(config_file)
+    except yaml.YAMLError as exc:
+        logging.error(exc)
+        exit(1)
+
+    errors = missing_keys(config, required_keys, config_file)
+    for error in errors:
+        logging.error(error)
+    if len(errors):
+        exit(1)
 
     logging.debug("config %s pass" % config_file)
     return config
@@ -52,22 +67,170 @@ def try_mkdir(dst, force_delete):
 def get_git_sha(repo_dir):
     return git.Repo(repo_dir).head.object.hexsha
 
-def clone_repo(repo_url, commit, repo_dir, force_delete):
+# untracked files count, as a check can read a testbench or include that hasn't been committed
+def git_is_dirty(repo_dir):
+    return git.Repo(repo_dir).is_dirty(untracked_files=True)
 
-    if os.path.exists(repo_dir):
-        if force_delete:
-            logging.warning("deleting %s" % repo_dir)
-            shutil.rmtree(repo_dir)
+mirror_locks = {}
+mirror_locks_lock = threading.Lock()
+
+def is_sha(commit):
+    return len(commit) == 40 and all(c in '0123456789abcdef' for c in commit.lower())
+
+# a bare repo per url, shared between shuttles so that objects are only downloaded once
+def update_mirror(repo_url, commit, cache_dir):
+    parsed = urlparse(repo_url)
+    mirror_dir = os.path.join(cache_dir, parsed.netloc, parsed.path.strip('/'))
+    if not mirror_dir.endswith('.git'):
+        mirror_dir += '.git'
+
+    with mirror_locks_lock:
+        lock = mirror_locks.setdefault(mirror_dir, threading.Lock())
+
+    with lock:
+        if os.path.exists(mirror_dir):
+            mirror = git.Repo(mirror_dir)
         else:
-            logging.warning("directory %s already exists - skipping. Use --force-delete to remove" % repo_dir)
+            logging.info("creating mirror %s" % mirror_dir)
+            mirror = git.Repo.init(mirror_dir, bare=True)
+            # so that clones can fetch pinned commits by sha
+            mirror.git.config('uploadpack.allowAnySHA1InWant', 'true')
+
+        # keep each pinned commit under its own ref, so it's not garbage collected and can be fetched by name
+        ref = 'refs/pinned/%s' % commit
+        if is_sha(commit):
+            try:
+                mirror.git.cat_file('-e', commit + '^{commit}')
+                logging.info("%s already in mirror" % commit)
+                mirror.git.update_ref(ref, commit)
+                return mirror_dir
+            except git.GitCommandError:
+                pass
+
+        logging.info("fetching %s %s into mirror" % (repo_url, commit))
+        fetch_commit(mirror, repo_url, commit)
+        mirror.git.update_ref(ref, 'FETCH_HEAD')
+
+    return mirror_dir
+
+# shallow fetch of a single commit or branch into FETCH_HEAD, falling back to a full fetch if the server won't give a single commit
+def fetch_commit(repo, source, commit):
+    try:
+        repo.git.fetch('--depth', '1', source, commit)
+    except git.GitCommandError as e:
+        logging.warning("shallow fetch of %s from %s failed, fetching everything" % (commit, source))
+        repo.git.fetch(source, '+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*', '--update-head-ok')
+        repo.git.update_ref('FETCH_HEAD', repo.git.rev_parse(commit + '^{commit}'))
+
+def clone_repo(repo_url, commit, repo_dir, force_delete, cache_dir=None):
+
+    if os.path.exists(repo_dir) and force_delete:
+        logging.warning("deleting %s" % repo_dir)
+        shutil.rmtree(repo_dir)
+
+    source = repo_url
+    if cache_dir is not None:
+        source = update_mirror(repo_url, commit, os.path.abspath(cache_dir))
+
+    if os.path.exists(repo_dir):
+        repo = git.Repo(repo_dir)
+        if is_sha(commit) and repo.head.is_valid() and repo.head.object.hexsha == commit:
+            logging.info("%s already at %s" % (repo_dir, commit))
             return
+        logging.info("updating %s to %s" % (repo_dir, commit))
+    else:
+        logging.info("cloning %s" % repo_url)
+        repo = git.Repo.init(repo_dir)
+        repo.create_remote('origin', repo_url)
+        if source != repo_url:
+            # borrow objects from the mirror instead of copying them
+            with open(os.path.join(repo.git_dir, 'objects', 'info', 'alternates'), 'w') as fh:
+                fh.write(os.path.join(source, 'objects') + "\n")
+
+    if source != repo_url:
+        fetch_commit(repo, source, 'refs/pinned/%s' % commit)
+    else:
+        fetch_commit(repo, source, commit)
 
-    logging.info("cloning %s" % repo_url)
-    repo = git.Repo.clone_from(repo_url, repo_dir)
     logging.info("checking out to %s" % commit)
-    repo.git.checkout(commit)
+    if is_sha(commit):
+        repo.git.checkout('--detach', 'FETCH_HEAD')
+    else:
+        # a branch name, so keep a local branch as a normal clone would
+        repo.git.checkout('-B', commit, 'FETCH_HEAD')
 
     logging.info("installing submodules")
     # the submodule support for gitpython is broken, so use git (via repo) to do the work instead.
-    repo.git.submodule('update', '--init', '--recursive')
+    try:
+        repo.git.submodule('update', '--init', '--recursive', '--depth', '1')
+    except git.GitCommandError:
+        repo.git.submodule('update', '--init', '--recursive')
+
+# per thread state, set by the scheduler so that output from parallel tasks can be captured to separate log files
+task_context = threading.local()
+
+# where command output goes when there isn't a task log, None for the console. the server sets it to the client's connection
+command_output = None
+
+# like subprocess.run, but the command's time, cpu and memory are recorded with os.wait4
+def run_cmd(cmd, check=False, capture_output=False, timeout=None, **kwargs):
+    # if a task log is set, send the subprocess output there instead of the console
+    log_fh = getattr(task_context, 'log_fh', None) or command_output
+    if log_fh is not None and not capture_output:
+        log_fh.flush()
+        kwargs['stdout'] = log_fh
+        kwargs['stderr'] = subprocess.STDOUT
+
+    # captured output goes to temporary files instead of pipes, so the process can be waited for without communicate
+    text = kwargs.pop('text', False) or kwargs.pop('universal_newlines', False)
+    if capture_output:
+        kwargs['stdout'] = tempfile.TemporaryFile()
+        kwargs['stderr'] = tempfile.TemporaryFile()
+
+    start = time.monotonic()
+    process = subprocess.Popen(cmd, **kwargs)
+    timer = None
+    timed_out = threading.Event()
+    # a command started in its own session is killed along with everything it started
+    def kill():
+        if kwargs.get('start_new_session'):
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        else:
+            process.kill()
+
+    if timeout is not None:
+        def kill_on_timeout():
+            timed_out.set()
+            kill()
+        timer = threading.Timer(timeout, kill_on_timeout)
+        timer.start()
+    try:
+        pid, status, rusage = os.wait4(process.pid, 0)
+    except BaseException:
+        kill()
+        process.wait()
+        raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    record_command(cmd, time.monotonic() - start, rusage, process.returncode)
+
+    stdout = stderr = None
+    if capture_output:
+        outputs = []
+        for fh in (kwargs['stdout'], kwargs['stderr']):
+            fh.seek(0)
+            output = fh.read()
+            fh.close()
+            outputs.append(output.decode(errors='replace') if text else output)
+        stdout, stderr = outputs
 
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout, stdout, stderr)
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
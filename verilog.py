@@ -0,0 +1,286 @@
+import ast
+import json
+import logging
+import operator
+import os
+import re
+import tempfile
+from utils import run_cmd
+
+# same defines as used when the wrapper is built
+DEFAULT_DEFINES = {'USE_POWER_PINS': '1', 'MPRJ_IO_PADS': '38'}
+
+class PortParseError(Exception):
+    pass
+
+module_declaration_re = re.compile(rb'^[ \t]*(?:macromodule|module)[ \t]+(\\\S+|[A-Za-z_][\w$]*)', re.M)
+comment_re      = re.compile(r'//[^\n]*|/\*.*?\*/', re.S)
+directive_re    = re.compile(r'`(ifdef|ifndef|elsif|else|endif|define|undef|include|timescale|default_nettype|resetall|celldefine|endcelldefine)\b([^\n]*)')
+macro_re        = re.compile(r'`(\w+)')
+range_re        = re.compile(r'\[([^\]:]+):([^\]]+)\]')
+identifier_re   = re.compile(r'[A-Za-z_]\w*')
+
+def strip_comments(text):
+    # keep the newlines so that directives stay on their own lines
+    return comment_re.sub(lambda m: '\n' * m.group(0).count('\n') or ' ', text)
+
+# handles `ifdef/`ifndef/`else/`elsif/`endif and `define, and expands macros. defines is updated with any new `defines
+def preprocess(text, defines):
+    output = []
+    # each level is (enclosing level active, a branch of this level has been taken)
+    stack = []
+    active = True
+    for line in strip_comments(text).split('\n'):
+        m = directive_re.search(line)
+        if m is None:
+            if active:
+                output.append(macro_re.sub(lambda m: defines.get(m.group(1), m.group(0)), line))
+            else:
+                output.append('')
+            continue
+
+        directive, rest = m.group(1), m.group(2).strip()
+        name = rest.split()[0] if rest else ''
+        if directive in ('ifdef', 'ifndef'):
+            taken = (name in defines) == (directive == 'ifdef')
+            stack.append((active, taken))
+            active = active and taken
+        elif directive in ('elsif', 'else', 'endif') and not len(stack):
+            raise PortParseError("`%s without `ifdef" % directive)
+        elif directive == 'elsif':
+            parent, taken = stack[-1]
+            active = parent and not taken and name in defines
+            stack[-1] = (parent, taken or active)
+        elif directive == 'else':
+            parent, taken = stack[-1]
+            active = parent and not taken
+            stack[-1] = (parent, True)
+        elif directive == 'endif':
+            active = stack.pop()[0]
+        elif directive == 'define' and active:
+            parts = rest.split(None, 1)
+            if len(parts) and '(' not in parts[0]:
+                defines[parts[0]] = parts[1].strip() if len(parts) > 1 else ''
+        elif directive == 'undef' and active:
+            defines.pop(name, None)
+
+        # keep line numbers
+        output.append('')
+
+    if len(stack):
+        raise PortParseError("`ifdef without `endif")
+    return '\n'.join(output)
+
+operators = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.FloorDiv: operator.floordiv, ast.Div: operator.floordiv, ast.Mod: operator.mod,
+    ast.Pow: operator.pow, ast.LShift: operator.lshift, ast.RShift: operator.rshift,
+}
+
+# integer arithmetic on constants and parameters, anything else is left for yosys
+def evaluate(expression, parameters):
+    expression = expression.strip()
+    def value(node):
+        if isinstance(node, ast.Expression):
+            return value(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, int):
+            return node.value
+        if isinstance(node, ast.Name) and node.id in parameters:
+            return parameters[node.id]
+        if isinstance(node, ast.BinOp) and type(node.op) in operators:
+            return operators[type(node.op)](value(node.left), value(node.right))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -value(node.operand)
+        raise PortParseError("can't evaluate %s" % expression)
+
+    try:
+        return value(ast.parse(expression, mode='eval'))
+    except SyntaxError:
+        raise PortParseError("can't evaluate %s" % expression)
+
+# split on commas that aren't inside brackets, braces or parentheses
+def split_top_level(text, separator=','):
+    parts = []
+    depth = 0
+    current = ''
+    for char in text:
+        if char in '([{':
+            depth += 1
+        elif char in ')]}':
+            depth -= 1
+        if char == separator and depth == 0:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    parts.append(current)
+    return parts
+
+def matching_paren(text, start):
+    depth = 0
+    for index in range(start, len(text)):
+        if text[index] == '(':
+            depth += 1
+        elif text[index] == ')':
+            depth -= 1
+            if depth == 0:
+                return index
+    raise PortParseError("unbalanced parentheses")
+
+# returns the direction, width and names of a declaration like "input wire [3:0] a, b"
+def parse_declaration(declaration, parameters):
+    direction = None
+    width = None
+    m = range_re.search(declaration)
+    if m is not None:
+        width = abs(evaluate(m.group(1), parameters) - evaluate(m.group(2), parameters)) + 1
+        declaration = declaration[:m.start()] + ' ' + declaration[m.end():]
+
+    names = []
+    for token in declaration.replace(',', ' ').split():
+        if token in ('input', 'output', 'inout'):
+            direction = token
+        elif token in ('wire', 'reg', 'logic', 'tri', 'signed', 'unsigned'):
+            continue
+        elif identifier_re.fullmatch(token):
+            names.append(token)
+        else:
+            raise PortParseError("can't parse declaration %s" % declaration)
+
+    if direction is not None and width is None:
+        width = 1
+    return direction, width, names
+
+def parse_parameters(text, parameters):
+    for item in split_top_level(text):
+        item = re.sub(r'\b(parameter|localparam|integer|signed)\b', '', item)
+        item = range_re.sub('', item)
+        if '=' not in item:
+            continue
+        name, default = item.split('=', 1)
+        try:
+            parameters[name.strip()] = evaluate(default, parameters)
+        except PortParseError:
+            pass
+
+# parse the ports of the module from the preprocessed source, without elaborating anything
+def parse_module_ports(text, module_name):
+    m = re.search(r'\bmodule\s+%s\b' % re.escape(module_name), text)
+    if m is None:
+        raise PortParseError("module %s not found" % module_name)
+
+    pos = m.end()
+    parameters = {}
+    rest = text[pos:].lstrip()
+    pos = len(text) - len(rest)
+    if rest.startswith('#'):
+        start = text.index('(', pos)
+        end = matching_paren(text, start)
+        parse_parameters(text[start + 1:end], parameters)
+        pos = end + 1
+
+    start = text.index('(', pos)
+    end = matching_paren(text, start)
+    header = text[start + 1:end]
+    body_end = text.find('endmodule', end)
+    body = text[end + 1:body_end]
+    for declaration in re.findall(r'\b(?:parameter|localparam)\b([^;]*);', body):
+        parse_parameters(declaration, parameters)
+
+    ports = {}
+    items = [item.strip() for item in split_top_level(header) if item.strip()]
+    if len(items) == 0:
+        return ports
+
+    direction = None
+    width = None
+    ansi = items[0].split()[0] in ('input', 'output', 'inout')
+    if ansi:
+        for item in items:
+            item_direction, item_width, names = parse_declaration(item, parameters)
+            # a port without a direction shares the previous declaration
+            if item_direction is not None:
+                direction, width = item_direction, item_width
+            elif item_width is not None:
+                width = item_width
+            for name in names:
+                ports[name] = {'direction': direction, 'width': width}
+        return ports
+
+    # non ANSI, the header only has the names and the declarations are in the body
+    for item in items:
+        if not identifier_re.fullmatch(item):
+            raise PortParseError("can't parse port %s" % item)
+        ports[item] = None
+    for statement in body.split(';'):
+        statement = statement.strip()
+        if statement.startswith(('input', 'output', 'inout')):
+            direction, width, names = parse_declaration(statement, parameters)
+            for name in names:
+                if name in ports:
+                    ports[name] = {'direction': direction, 'width': width}
+
+    missing = [name for name, port in ports.items() if port is None]
+    if len(missing):
+        raise PortParseError("no declaration for ports %s" % missing)
+    return ports
+
+# names of the modules declared in a source file, in order. a quick scan for declarations at the start of a line, nothing is preprocessed,
+# so it also finds modules in comments and `ifdefs that are off
+def scan_module_declarations(path):
+    modules = []
+    tail = b''
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            block = tail + block
+            # only scan complete lines, the rest is carried over to the next block
+            end = block.rfind(b'\n') + 1
+            modules += module_declaration_re.findall(block, 0, end)
+            tail = block[end:]
+    modules += module_declaration_re.findall(tail)
+    return [module.decode(errors='replace') for module in modules]
+
+# the modules really declared in each source once comments and `ifdefs are taken into account. slower than the scan, so only used
+# to confirm what it finds. the sources are read in order, as `defines in one are used by the next
+def preprocessed_module_declarations(sources, defines=None):
+    defines = dict(DEFAULT_DEFINES if defines is None else defines)
+    modules = {}
+    for source in sources:
+        with open(source) as fh:
+            text = preprocess(fh.read(), defines)
+        modules[source] = [module.decode(errors='replace') for module in module_declaration_re.findall(text.encode())]
+    return modules
+
+def extract_ports_native(sources, top, defines=None):
+    defines = dict(DEFAULT_DEFINES if defines is None else defines)
+    # `defines from earlier files are used by later ones, so go through them in order
+    for source in sources:
+        with open(source) as fh:
+            text = preprocess(fh.read(), defines)
+        if re.search(r'\bmodule\s+%s\b' % re.escape(top), text):
+            return parse_module_ports(text, top)
+    raise PortParseError("module %s not found in %s" % (top, sources))
+
+def extract_ports_yosys(sources, top):
+    fd, json_file = tempfile.mkstemp(prefix='ports_', suffix='.json')
+    os.close(fd)
+    try:
+        script = "read_verilog -sv %s; hierarchy -top %s ; proc; json -o %s x:*" % (' '.join(sources), top, json_file)
+        run_cmd(['yosys', '-qp', script, '-DUSE_POWER_PINS=1', '-DMPRJ_IO_PADS=38'], check=True)
+        with open(json_file) as fh:
+            netlist = json.load(fh)
+    finally:
+        os.remove(json_file)
+
+    ports = {}
+    for name, port in netlist['modules'][top]['ports'].items():
+        ports[name] = {'direction': port['direction'], 'width': len(port['bits'])}
+    return ports
+
+# parse the module header directly, and only run yosys if that doesn't work
+def extract_ports(sources, top):
+    try:
+        return extract_ports_native(sources, top)
+    except (PortParseError, ValueError) as e:
+        logging.info("falling back to yosys to get ports of %s: %s" % (top, e))
+        return extract_ports_yosys(sources, top)